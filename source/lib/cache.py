@@ -0,0 +1,488 @@
+import fcntl
+import hashlib
+import io
+import json
+import os
+import pickle
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from config import config
+from traverser import Traverser, Element, Dated, Date, Empty, Block, \
+    Description
+
+
+def get_cache_dir() -> Path:
+    cache = Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser()
+    our_cache = cache / 'timeline'
+    our_cache.mkdir(exist_ok=True, parents=True)
+    return our_cache
+
+
+def get_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class Manifest:
+    """
+    Index of the filter results in the cache directory, kept in a JSON file
+    next to them. Each result is recorded with its size and the times it was
+    created and last accessed, the least recently accessed first, so that
+    the results are evicted without listing the directory. A result is
+    recorded before its files are created, so that it is evicted even if
+    the program crashes before it is finished. Only when the manifest is
+    missing or invalid, it is recovered by scanning the whole directory.
+
+    Use as a context manager, which holds an exclusive lock on the manifest.
+    """
+    FILENAME = 'manifest.json'
+    LOCKNAME = 'manifest.lock'
+    VERSION = 1
+    SUFFIXES = ('.tln', '.sync')
+
+    def __init__(self) -> None:
+        self.cache = get_cache_dir()
+        self.path = self.cache / self.FILENAME
+        # name: {'size': bytes or None, 'created': time, 'accessed': time},
+        # the least recently accessed first
+        self.entries: dict[str, dict[str, Any]] = {}
+        # the total size of the entries
+        self.size = 0
+        self.changed = False
+        self.lock: io.TextIOWrapper | None = None
+
+    def __enter__(self) -> 'Manifest':
+        self.lock = open(self.cache / self.LOCKNAME, 'a')
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        if not self.load():
+            self.rescan()
+        return self
+
+    def __exit__(self, *args) -> None:
+        try:
+            if self.changed:
+                self.write()
+        finally:
+            # releases the lock
+            self.lock.close()
+
+    def load(self) -> bool:
+        try:
+            with open(self.path) as file_in:
+                data = json.load(file_in)
+            if data['version'] != self.VERSION:
+                return False
+            self.entries = data['entries']
+            self.size = sum(entry['size'] or 0
+                            for entry in self.entries.values())
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return False
+        return True
+
+    def rescan(self) -> None:
+        # Recover the manifest from the directory. Remove everything that
+        # isn't a filter result or a sidecar directory, the order of
+        # the results is given by their mtime.
+        sidecars = {ParseCache.DIRNAME, CheckpointIndex.DIRNAME,
+                    FilterMemo.DIRNAME, self.FILENAME, self.LOCKNAME}
+        entries: dict[str, dict[str, Any]] = {}
+        for child in self.cache.iterdir():
+            if child.name in sidecars:
+                continue
+            if not child.is_file() or child.suffix not in self.SUFFIXES:
+                child.unlink()
+                continue
+            stat = child.stat()
+            entry = entries.setdefault(child.stem, {
+                'size': 0, 'created': stat.st_mtime, 'accessed': 0,
+            })
+            entry['size'] += stat.st_size
+            entry['created'] = min(entry['created'], stat.st_mtime)
+            entry['accessed'] = max(entry['accessed'], stat.st_mtime)
+        self.entries = dict(sorted(entries.items(),
+                                   key=lambda item: item[1]['accessed']))
+        self.size = sum(entry['size'] for entry in self.entries.values())
+        self.changed = True
+
+    def write(self) -> None:
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            # json.dump() doesn't use the C encoder
+            tmp_path.write_text(json.dumps(
+                {'version': self.VERSION, 'entries': self.entries}
+            ))
+            # atomically replace, so that a crash never leaves a partially
+            # written manifest
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # the manifest will be recovered by the next rescan
+            tmp_path.unlink(missing_ok=True)
+
+    def add(self, basename: str) -> None:
+        # record a result before its files are created, its size is not known
+        # yet
+        now = time.time()
+        self.entries[Path(basename).name] = {
+            'size': None, 'created': now, 'accessed': now,
+        }
+        self.changed = True
+
+    def touch(self, basename: str) -> None:
+        # mark the result as the most recently accessed one and record its
+        # size, if it isn't known yet
+        name = Path(basename).name
+        entry = self.entries.pop(name, None) or {'size': None,
+                                                  'created': time.time()}
+        self.changed = True
+        if entry['size'] is None:
+            try:
+                entry['size'] = sum(
+                    (self.cache / f'{name}{suffix}').stat().st_size
+                    for suffix in self.SUFFIXES
+                )
+            except FileNotFoundError:
+                # the result has been removed in the meantime
+                return
+            self.size += entry['size']
+        entry['accessed'] = time.time()
+        self.entries[name] = entry
+
+    def evict(self, keep: str) -> None:
+        # Remove the least recently accessed results while there are more of
+        # them than FilterHistoryCount or they are larger than
+        # FilterHistorySize, but never the result keep.
+        keep = Path(keep).name
+        while (len(self.entries) > config.FilterHistoryCount
+               or self.size > config.FilterHistorySize):
+            name = next(iter(self.entries))
+            if name == keep:
+                break
+            entry = self.entries.pop(name)
+            self.size -= entry['size'] or 0
+            for suffix in self.SUFFIXES:
+                (self.cache / f'{name}{suffix}').unlink(missing_ok=True)
+            self.changed = True
+
+
+class Sidecar:
+    """
+    Base of the caches that store information derived from a timeline file in
+    a file in the subdirectory DIRNAME of the cache directory.
+    """
+    # increment whenever the parsing or the element classes change
+    VERSION = 3
+    DIRNAME: str
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path).resolve()
+        name = get_digest(str(self.path).encode())
+        self.cache_path = get_cache_dir() / self.DIRNAME / f'{name}.pickle'
+
+    def get_key(self) -> tuple:
+        # Whether a line is an item depends on the leave matching, so the
+        # parsed elements are only valid for the same CaseSensitiveLeave.
+        return self.VERSION, config.CaseSensitiveLeave
+
+    def read(self) -> Iterator[Any]:
+        # yield the pickled objects from the cache file, the first one being
+        # the key
+        with open(self.cache_path, 'rb') as cache:
+            if pickle.load(cache) != self.get_key():
+                return
+            while True:
+                try:
+                    yield pickle.load(cache)
+                except EOFError:
+                    return
+
+    def write(self, *objects: Any) -> None:
+        tmp_path = self.cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            self.cache_path.parent.mkdir(exist_ok=True)
+            with open(tmp_path, 'wb') as cache:
+                for obj in (self.get_key(), *objects):
+                    pickle.dump(obj, cache, pickle.HIGHEST_PROTOCOL)
+            # atomically replace, so that a concurrent reader never sees
+            # a partially written cache
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # caching is only an optimization
+            tmp_path.unlink(missing_ok=True)
+
+
+# exceptions signalizing missing, outdated or corrupted cache. Unpickling calls
+# the constructors of the pickled classes, which may raise anything, and
+# the cache is only an optimization, so any failure is treated as a miss.
+CACHE_ERRORS = (Exception,)
+
+
+class ParseCache(Sidecar):
+    """
+    On-disk cache of the elements parsed from a timeline file. The elements are
+    stored together with the size, mtime and content hash of the file, so that
+    an unchanged file is never parsed twice. The cached elements are not bound
+    to any Traverser - use Traverser.replay() to traverse them.
+    """
+    DIRNAME = 'parsed'
+
+    def elements(self) -> list[Element]:
+        # return the cached elements if the file didn't change, parse the file
+        # and cache the result otherwise
+        with open(self.path, 'rb') as file_in:
+            stat = os.fstat(file_in.fileno())
+            elements = self.load(stat.st_size, stat.st_mtime_ns, file_in)
+            if elements is not None:
+                return elements
+            file_in.seek(0)
+            data = file_in.read()
+        elements = self.parse(data)
+        self.write({
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'digest': get_digest(data),
+        }, elements)
+        return elements
+
+    def is_current(self) -> bool:
+        # whether elements() would load the elements from the cache, without
+        # loading them
+        with open(self.path, 'rb') as file_in:
+            stat = os.fstat(file_in.fileno())
+            try:
+                return self.check(next(self.read()), stat.st_size,
+                                  stat.st_mtime_ns, file_in)
+            except (StopIteration, *CACHE_ERRORS):
+                return False
+
+    def load(self, size: int, mtime_ns: int, file_in: io.BufferedReader)\
+            -> list[Element] | None:
+        try:
+            cache = self.read()
+            if not self.check(next(cache), size, mtime_ns, file_in):
+                return None
+            return next(cache)
+        except (StopIteration, *CACHE_ERRORS):
+            # parse the file instead
+            return None
+
+    @staticmethod
+    def check(header: dict[str, Any], size: int, mtime_ns: int,
+              file_in: io.BufferedReader) -> bool:
+        if header['size'] != size:
+            return False
+        # mtime changes even if the file is saved without changes, then
+        # fall back to comparing the content
+        return (header['mtime_ns'] == mtime_ns
+                or header['digest'] == get_digest(file_in.read()))
+
+    @staticmethod
+    def parse(data: bytes) -> list[Element]:
+        # decode the same way as open() in text mode does
+        file_in = io.TextIOWrapper(io.BytesIO(data))
+        traverser = Traverser()
+        elements: list[Element] = []
+
+        def record(element: Element) -> Element:
+            elements.append(element)
+            return element
+
+        traverser.traverse_elements(
+            map(record, traverser.parse_lines(file_in, -1))
+        )
+        # the dates are bound by the replaying Traverser
+        for element in elements:
+            if isinstance(element, Dated):
+                element.date = None
+        return elements
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    # the state of a Traverser after parsing the line 'linenumber'
+    linenumber: int
+    # the position of the next line in the file
+    offset: int
+    # content hash of the file up to the offset
+    digest: str
+    # pickled Traverser.get_state()
+    state: bytes
+
+
+class CheckpointIndex(Sidecar):
+    """
+    Sidecar index of Traverser states saved every INTERVAL lines of a timeline
+    file. Traversing the first lines of the file resumes from the last saved
+    state above them and only parses the rest. Each state is valid as long as
+    the file doesn't change above it, so an edit invalidates only
+    the checkpoints below it.
+    """
+    DIRNAME = 'checkpoints'
+    INTERVAL = 500
+    # after these elements, parse_lines doesn't have any unfinished note
+    RESUMABLE = (Empty, Date, Block, Description)
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        self.checkpoints: list[Checkpoint] = []
+        # the position in the file after the last parsed line
+        self.offset = 0
+        # content hash of the file up to the position 'hashed'
+        self.hasher = hashlib.blake2b(digest_size=16)
+        self.hashed = 0
+
+    def traverse(self, traverser: Traverser, max_lines: int = -1) -> int:
+        # Traverse the file like Traverser.traverse() does, but start at
+        # the last checkpoint above the line max_lines and save new checkpoints
+        # on the way. Return the line the traversal resumed after, 0 if it
+        # started from the beginning.
+        with open(self.path, 'rb') as file_in:
+            stat = os.fstat(file_in.fileno())
+            data = file_in.read()
+        self.load(data, stat.st_size, stat.st_mtime_ns)
+        above = len(self.checkpoints)
+        while (max_lines > 0 and above
+               and self.checkpoints[above - 1].linenumber >= max_lines):
+            above -= 1
+        # the checkpoints below max_lines stay as they are
+        below = self.checkpoints[above:]
+        del self.checkpoints[above:]
+        state = None
+        if self.checkpoints:
+            try:
+                state = pickle.loads(self.checkpoints[-1].state)
+            except CACHE_ERRORS:
+                # start over, saving new checkpoints on the way
+                self.checkpoints.clear()
+                below.clear()
+        if state is not None:
+            checkpoint = self.checkpoints[-1]
+            traverser.set_state(state)
+            first_linenumber = checkpoint.linenumber + 1
+            self.offset = checkpoint.offset
+        else:
+            first_linenumber = 1
+            self.offset = 0
+        elements = traverser.parse_lines(
+            self.read_lines(data), max_lines, first_linenumber
+        )
+        traverser.traverse_elements(self.save(traverser, elements, data))
+        self.checkpoints += below
+        self.write({
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }, self.checkpoints)
+        return first_linenumber - 1
+
+    def load(self, data: bytes, size: int, mtime_ns: int) -> None:
+        # load the checkpoints and drop those that are no longer valid
+        try:
+            cache = self.read()
+            header = next(cache)
+            self.checkpoints = next(cache)
+        except (StopIteration, *CACHE_ERRORS):
+            self.checkpoints = []
+            return
+        if header['size'] == size and header['mtime_ns'] == mtime_ns:
+            return
+        for index, checkpoint in enumerate(self.checkpoints):
+            if self.get_digest(data, checkpoint.offset) != checkpoint.digest:
+                # the file changed above this checkpoint
+                del self.checkpoints[index:]
+                return
+
+    def get_digest(self, data: bytes, offset: int) -> str:
+        # content hash of data[:offset]
+        if offset < self.hashed:
+            self.hasher = hashlib.blake2b(digest_size=16)
+            self.hashed = 0
+        self.hasher.update(data[self.hashed:offset])
+        self.hashed = offset
+        return self.hasher.hexdigest()
+
+    def read_lines(self, data: bytes) -> Iterator[str]:
+        # yield the lines from self.offset on, keeping self.offset at the
+        # position after the yielded line
+        buffer = io.BytesIO(data)
+        buffer.seek(self.offset)
+        # decode the same way as open() in text mode does, but keep the line
+        # endings to be able to count the bytes
+        file_in = io.TextIOWrapper(buffer, newline='')
+        for line in file_in:
+            self.offset += len(line.encode(file_in.encoding))
+            yield line
+
+    def save(self, traverser: Traverser, elements: Iterator[Element],
+             data: bytes) -> Iterator[Element]:
+        # pass the elements through while saving checkpoints
+        next_linenumber = (self.checkpoints[-1].linenumber if self.checkpoints
+                           else 0) + self.INTERVAL
+        for element in elements:
+            yield element
+            # the element has been traversed now and parse_lines is waiting
+            # before the next line
+            if (element.linenumber >= next_linenumber
+                    and isinstance(element, self.RESUMABLE)):
+                self.checkpoints.append(Checkpoint(
+                    element.linenumber, self.offset,
+                    self.get_digest(data, self.offset),
+                    pickle.dumps(traverser.get_state(),
+                                 pickle.HIGHEST_PROTOCOL)
+                ))
+                next_linenumber = element.linenumber + self.INTERVAL
+
+
+class FilterMemo(Sidecar):
+    """
+    Index of the filter results of a timeline file kept in the cache directory.
+    A result is found by the content hash of the file together with the search
+    term and the configuration it was filtered with, so that filtering
+    an unchanged file again reuses the result instead of parsing and scoring
+    the file.
+    """
+    DIRNAME = 'filtered'
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        # size, mtime and content hash of the file
+        self.header: dict[str, Any] = {}
+        # (digest, *query): basename of the result
+        self.results: dict[tuple, str] = {}
+        try:
+            cache = self.read()
+            self.header = next(cache)
+            self.results = next(cache)
+        except (StopIteration, *CACHE_ERRORS):
+            self.header = {}
+            self.results = {}
+        with open(self.path, 'rb') as file_in:
+            stat = os.fstat(file_in.fileno())
+            if (self.header.get('size') != stat.st_size
+                    or self.header.get('mtime_ns') != stat.st_mtime_ns):
+                self.header = {
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'digest': get_digest(file_in.read()),
+                }
+
+    def lookup(self, query: tuple) -> str | None:
+        # the basename of the result of the query on the current content of
+        # the file, None if there is none or it has been pruned since
+        basename = self.results.get((self.header['digest'], *query))
+        if basename is None or not all(
+                Path(f'{basename}{suffix}').is_file()
+                for suffix in ('.tln', '.sync')
+        ):
+            return None
+        return basename
+
+    def record(self, query: tuple, basename: str) -> None:
+        # forget the results removed by prune_cache
+        self.results = {
+            key: value for key, value in self.results.items()
+            if Path(f'{value}.tln').is_file()
+        }
+        self.results[(self.header['digest'], *query)] = basename
+        self.write(self.header, self.results)
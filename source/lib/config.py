@@ -1,77 +1,168 @@
 from abc import abstractmethod
-from configparser import ConfigParser
-from functools import partialmethod, update_wrapper
+from configparser import ConfigParser, Error as ConfigParserError
 from pathlib import Path
-from typing import Generic, TypeVar
+from typing import Any, Generic, TypeVar
 
 T = TypeVar('T')
+# the names of the matchers in matcher.MATCHERS, kept here because matcher.py
+# reads the configuration
+MATCHER_NAMES = ('exact', 'regex', 'token', 'soundex', 'fuzzy')
 
 
-class Value[T](property):
-    def __init__(self, default=None, doc=None):
-        super().__init__(self.get_value, doc=doc)
+class ConfigError(Exception):
+    pass
+
+
+class Value[T]:
+    # A non-data descriptor: once the configuration is loaded, the value is
+    # stored in the instance __dict__, which takes precedence, so reading it is
+    # a plain attribute access.
+    def __init__(self, default: T, doc=None):
         self.default = default
+        self.__doc__ = doc
 
     def __set_name__(self, owner, name):
         self.name = name
 
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return self.default
+
+    def parse(self, raw: str) -> T:
+        try:
+            return self.convert(raw)
+        except ValueError as e:
+            raise ConfigError(
+                f'invalid value {raw!r} of {self.name}: {e}'
+            ) from e
+
     @abstractmethod
-    def get_value(self, owner: 'Config') -> T:
+    def convert(self, raw: str) -> T:
         ...
 
 
 class IntValue(Value[int]):
-    def get_value(self, owner: 'Config') -> int:
-        return owner.getint(self.name, self.default)
+    def __init__(self, default: int, doc=None, minimum: int | None = None,
+                 maximum: int | None = None):
+        super().__init__(default, doc)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def convert(self, raw: str) -> int:
+        value = int(raw)
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f'must be at least {self.minimum}')
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(f'must be at most {self.maximum}')
+        return value
 
 
 class StrValue(Value[str]):
-    def get_value(self, owner: 'Config') -> str:
-        return owner.getstr(self.name, self.default)
+    def convert(self, raw: str) -> str:
+        return raw
+
+
+class ChoiceValue(StrValue):
+    def __init__(self, default: str, choices: tuple[str, ...], doc=None):
+        super().__init__(default, doc)
+        self.choices = choices
+
+    def convert(self, raw: str) -> str:
+        if raw not in self.choices:
+            raise ValueError(f'must be one of {", ".join(self.choices)}')
+        return raw
 
 
 class BoolValue(Value[bool]):
-    def get_value(self, owner: 'Config') -> bool:
-        return owner.getboolean(self.name, self.default)
+    def convert(self, raw: str) -> bool:
+        try:
+            return ConfigParser.BOOLEAN_STATES[raw.lower()]
+        except KeyError:
+            raise ValueError('not a boolean') from None
 
 
 class ConfigBase:
+    """
+    Immutable snapshot of the configuration. The files are read in order, each
+    overriding the values set by the previous ones, and all the values are
+    parsed and validated at once. Long-running processes can read the files
+    again by reload(). The relative paths are relative to directory, by default
+    the working directory.
+    """
     SECTIONNAME = 'timeline'
-
-    def __init__(self):
-        # TODO: on python 13.0, add allow_unnamed_section=True
-        self.parser = ConfigParser(empty_lines_in_values=False)
-        self.parser.optionxform = self.optionxform
-        self.parser.read([
-            '/etc/timeline.conf',
-            Path('~/.config/timeline.conf').expanduser(),
-            'timeline.conf',
-        ])
+    FILES = (
+        '/etc/timeline.conf',
+        '~/.config/timeline.conf',
+        'timeline.conf',
+    )
+    DEFAULT_SOURCE = 'default'
+
+    def __init__(self, directory: Path = Path()):
+        self.__dict__['directory'] = directory
+        self.reload()
+
+    def get_values(self) -> dict[str, Value]:
+        return {
+            name: value for cls in reversed(type(self).__mro__)
+            for name, value in vars(cls).items() if isinstance(value, Value)
+        }
+
+    def reload(self) -> None:
+        values = self.get_values()
+        snapshot: dict[str, Any] = {
+            name: value.default for name, value in values.items()
+        }
+        sources = dict.fromkeys(values, self.DEFAULT_SOURCE)
+        for file in self.FILES:
+            path = (self.directory / Path(file).expanduser()).absolute()
+            # TODO: on python 13.0, add allow_unnamed_section=True
+            parser = ConfigParser(empty_lines_in_values=False)
+            parser.optionxform = self.optionxform
+            try:
+                if not parser.read(path) or not parser.has_section(
+                        self.SECTIONNAME):
+                    continue
+                section = parser[self.SECTIONNAME]
+                for name, value in values.items():
+                    if name in section:
+                        snapshot[name] = value.parse(section[name])
+                        sources[name] = str(path)
+            except (ConfigParserError, ConfigError) as e:
+                raise ConfigError(f'{path}: {e}') from e
+        # replace the whole snapshot only when everything is valid
+        self.__dict__.update(snapshot)
+        self.__dict__['sources'] = sources
+
+    def get_snapshot(self) -> dict[str, Any]:
+        # the values by their names
+        return {name: getattr(self, name) for name in self.get_values()}
+
+    def get_source(self, name: str) -> str:
+        # the file which set the value, or DEFAULT_SOURCE
+        return self.sources[name]
+
+    def __setattr__(self, name, value):
+        raise AttributeError('the configuration is read-only, use reload() '
+                             'to read the files again')
 
     @staticmethod
     def optionxform(optionstr):
         # do not change the case of keys
         return optionstr
 
-    def getstr(self, key: str, fallback: str = None) -> str:
-        return self.parser.get(self.SECTIONNAME, key, fallback=fallback)
-
-    def getint(self, key: str, fallback: int = None) -> int:
-        return self.parser.getint(self.SECTIONNAME, key, fallback=fallback)
-
-    def getboolean(self, key: str, fallback: bool = None) -> bool:
-        return self.parser.getboolean(self.SECTIONNAME, key, fallback=fallback)
-
 
 class Config(ConfigBase):
     MainFile = StrValue('notes.tln')
-    FuzzySearchTolerance = IntValue(75)
+    FuzzySearchTolerance = IntValue(75, minimum=0, maximum=100)
     Locale = StrValue('C')
-    FilterHistoryCount = IntValue(10)
-    FilterHistorySize = IntValue(100000000)
+    FilterHistoryCount = IntValue(10, minimum=0)
+    FilterHistorySize = IntValue(100000000, minimum=0)
     CaseSensitiveLeave = BoolValue(False)
     CaseSensitiveSearch = BoolValue(False)
+    Matcher = ChoiceValue('fuzzy', MATCHER_NAMES)
+    SyncFormat = ChoiceValue('binary', ('text', 'binary'))
 
 
 config = Config()
-__all__ = ['config']
+__all__ = ['config', 'Config', 'ConfigError', 'MATCHER_NAMES']
@@ -0,0 +1,164 @@
+"""
+A timeline split into several files, e.g. one per arc or per year, is filtered
+as a corpus. The main file includes the other files by the command
+    @@ include PATH
+with PATH relative to the directory of the including file, and the included
+files can include further files. Each file is parsed on its own, then the
+elements of the files are merged chronologically section by section, where
+a section is a date together with the elements up to the next date of its
+file. The sections of the same date are merged under the date of the first
+one. The linenumbers of the merged elements are those of the sections laid out
+one after another by Layout, which maps them back to the files, see sync.py.
+"""
+import heapq
+import multiprocessing
+import os
+import re
+import sys
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass, field
+from operator import attrgetter
+from pathlib import Path
+
+from cache import ParseCache, get_digest
+from sync import Layout
+from traverser import Traverser, Element, Command, Date, Empty, Include, \
+    Syntax, UnknownCommandError
+
+# the lines that may be commands, to find the included files without parsing
+# the whole file
+COMMAND_LINE = re.compile(rf'^[ \t]*{re.escape(Syntax.COMMAND)}.*$',
+                          re.MULTILINE)
+
+
+def get_includes(path: Path) -> Iterator[tuple[int, Path]]:
+    # the included files together with the lines including them
+    text = path.read_text()
+    for match in COMMAND_LINE.finditer(text):
+        line = match.group()
+        # throw off comment, as parse_lines does
+        if (comment_index := line.find(Syntax.COMMENT)) != -1:
+            line = line[:comment_index]
+        try:
+            command = Command.parse(0, line.strip()[len(Syntax.COMMAND):])
+        except UnknownCommandError:
+            # reported when the file is parsed
+            continue
+        if isinstance(command, Include):
+            yield (text.count('\n', 0, match.start()) + 1,
+                   (path.parent / command.path).resolve())
+
+
+def get_files(main_file: Path) -> list[Path]:
+    # the main file followed by the files it includes, directly or not, each
+    # of them once. The files that cannot be read are reported and skipped.
+    files = [main_file]
+    for path in files:
+        for linenumber, include in get_includes(path):
+            if include in files:
+                continue
+            try:
+                include.open('rb').close()
+            except OSError as e:
+                print(f'{path}:{linenumber}: skipping the included file: {e}',
+                      file=sys.stderr)
+                continue
+            files.append(include)
+    return files
+
+
+def get_digests(files: Sequence[Path]) -> tuple[tuple[str, str], ...]:
+    return tuple((str(path), get_digest(path.read_bytes()))
+                 for path in files)
+
+
+def parse(path: Path) -> None:
+    # bring the parse cache of the file up to date
+    ParseCache(path).elements()
+
+
+def load_parsed(files: Sequence[Path]) -> list[list[Element]]:
+    # the elements of the files from their parse caches, after parsing
+    # the outdated files in parallel processes
+    outdated = [path for path in files if not ParseCache(path).is_current()]
+    if len(outdated) > 1:
+        with multiprocessing.get_context('fork').Pool(
+                min(len(outdated), os.cpu_count() or 1)) as pool:
+            pool.map(parse, outdated)
+    return [ParseCache(path).elements() for path in files]
+
+
+@dataclass(slots=True)
+class Section:
+    # the date of the section, completed by the previous dates of its file,
+    # as a tuple; () before the first date
+    key: tuple
+    file: int
+    date: Date | None
+    elements: list[Element] = field(default_factory=list)
+
+    def get_lines(self) -> range:
+        # the lines of the section in its file
+        return range(min(element.linenumber for element in self.elements),
+                     max(element.get_sync_range().stop
+                         for element in self.elements))
+
+
+def get_sections(file: int, elements: Sequence[Element]) -> Iterator[Section]:
+    # Split the elements of the file at its dates. The empty lines and
+    # commands right before a date belong to its section. The dates are
+    # completed by the previous dates of the file, so that they can be
+    # traversed after the dates of other files.
+    # only used to get the dates the same way the traversal does
+    dates = Traverser()
+    section = Section((), file, None)
+    # the empty lines and commands since the last other element
+    pending: list[Element] = []
+    for element in elements:
+        if isinstance(element, Command):
+            element.apply(dates)
+        if isinstance(element, (Empty, Command)):
+            pending.append(element)
+            continue
+        if isinstance(element, Date):
+            dates.date = element = dates.date.update(element)
+            if section.elements:
+                yield section
+            section = Section((element.year, element.month, element.day),
+                              file, element, pending)
+            pending = []
+        else:
+            section.elements += pending
+            pending.clear()
+        section.elements.append(element)
+    section.elements += pending
+    if section.elements:
+        yield section
+
+
+def merge(files: list[Path], elements_of_files: Sequence[Sequence[Element]])\
+        -> tuple[list[Element], Layout]:
+    # merge the elements of the files chronologically, the files keep their
+    # order on the same date
+    layout = Layout(files)
+    merged: list[Element] = []
+    linenumber = 1
+    key = None
+    for section in heapq.merge(*(
+        get_sections(file, elements)
+        for file, elements in enumerate(elements_of_files)
+    ), key=attrgetter('key')):
+        lines = section.get_lines()
+        shift = linenumber - lines.start
+        layout.add(linenumber, section.file, -shift)
+        linenumber += len(lines)
+        for element in section.elements:
+            element.move(shift)
+        if section.key == key:
+            # the date has already been traversed
+            merged += (element for element in section.elements
+                       if element is not section.date)
+        else:
+            merged += section.elements
+        key = section.key
+    return merged, layout
@@ -0,0 +1,49 @@
+import json
+import os
+import socket
+import tempfile
+from pathlib import Path
+from typing import Any
+
+
+class DaemonError(Exception):
+    pass
+
+
+def get_socket_path() -> Path:
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return Path(runtime) / 'timelined.sock'
+    return Path(tempfile.gettempdir()) / f'timelined-{os.getuid()}.sock'
+
+
+def request(message: dict[str, Any]) -> dict[str, Any] | None:
+    # Send the message to timelined and return its response. Return None if
+    # the daemon is not running, the socket belongs to another user or
+    # the daemon reads a different configuration than this process (see
+    # timelined.py), then the caller should do the work itself.
+    path = get_socket_path()
+    try:
+        if path.stat().st_uid != os.getuid():
+            return None
+    except FileNotFoundError:
+        return None
+    # the daemon compares its configuration to the one read there
+    message = {**message, 'cwd': os.getcwd()}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(path))
+            with client.makefile('rw', encoding='utf-8') as stream:
+                print(json.dumps(message), file=stream, flush=True)
+                line = stream.readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    if not line:
+        # the daemon has been stopped while processing the request
+        return None
+    response = json.loads(line)
+    if 'error' in response:
+        raise DaemonError(response['error'])
+    if 'fallback' in response:
+        return None
+    return response
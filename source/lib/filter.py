@@ -1,19 +1,46 @@
 #!/usr/bin/env python
+# imported first, to time the other imports
+import profiling
 import argparse
+import io
+import multiprocessing
 import os
+import subprocess
+import sys
 import locale
 import datetime
+import heapq
+import re
 from bisect import bisect, insort
 from dataclasses import dataclass, field
-from io import StringIO
-from typing import Iterable
-from thefuzz import fuzz
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+from typing import IO, Callable, Iterable, Iterator, Sequence, TextIO
 from configparser import ConfigParser
 from pathlib import Path
 
-from traverser import Traverser, Element, Date, Enter, Leave, Spaced, Dated, \
-    Note, Description, Empty, Ellipse, Syntax
+from traverser import Traverser, Element, Date, Block, Enter, Leave, Spaced, \
+    Dated, Note, Description, Empty, Ellipse, Command, Syntax, MappedLines
+import query
+from matcher import Matcher, LiveSearch, MATCHERS
+from sync import SYNC_FORMATS, Layout, open_sync
+from stream import Stream
+import daemon
 from config import config
+from cache import get_cache_dir, FilterMemo, Manifest
+import corpus
+
+# the size of the chunks the filtered timeline is written and copied in
+CHUNK_SIZE = 1 << 20
+# ParallelFilter splits the elements into this many chunks per worker process,
+# to balance the load, but at least into chunks of MIN_CHUNK_ELEMENTS elements
+CHUNKS_PER_WORKER = 4
+MIN_CHUNK_ELEMENTS = 4096
+# the number of states a worker of ParallelFilter records after it first
+# prints something
+CHECKPOINTS = 16
+# LiveFilter checks whether it is stale every STALE_INTERVAL elements
+STALE_INTERVAL = 1024
 
 
 @dataclass(slots=True, order=True)
@@ -25,12 +52,25 @@ class DescriptionEntry:
 
 
 class Filter(Traverser):
-    def __init__(self, find: str) -> None:
+    # whether everything is printed by print_atom, so that the result can be
+    # streamed while it is being filtered
+    STREAMS = True
+
+    def __init__(self, find: str, matcher: str | None = None,
+                 sync_format: str | None = None,
+                 layout: Layout | None = None) -> None:
         super(Filter, self).__init__()
-        # instead of files, first write to output buffers - at the end, we will
-        # need to prepend these buffers with the header
-        self.buffer_out = StringIO()
-        self.buffer_sync = StringIO()
+        # the format of the syncfile, linking to the files of the layout if
+        # the elements are merged from a corpus, see sync.py
+        self.sync_format = SYNC_FORMATS[sync_format or config.SyncFormat](
+            layout
+        )
+        # instead of files, first write to temporary files - at the end, we
+        # will need to prepend them with the header. They are closed by
+        # __exit__ or, at the latest, when garbage collected.
+        self.buffer_out = TemporaryFile('w+', buffering=CHUNK_SIZE)
+        self.buffer_sync = TemporaryFile(f'w+{self.sync_format.MODE}',
+                                         buffering=CHUNK_SIZE)
         # set of linenumbers of currently open blocks whose names got matched
         self.matched_enters: set[int] = set()
         # a flag that is set when a date is matched, to print the whole day
@@ -45,11 +85,38 @@ class Filter(Traverser):
         # blocks since the last printed information
         self.omitted_linenumbers: list[tuple[int, int]] = []
         self.last_printed_element: Element | None = None
-        # the search term
-        self.find: str = find if config.CaseSensitiveSearch else find.lower()
+        # the class of the matchers, see matcher.py
+        self.matcher_class = MATCHERS[matcher or config.Matcher]
+        # the matchers of the terms, a single one unless filtering by a query
+        self.matchers: list[Matcher] = [self.matcher_class(find)]
+        # if set, the printed elements are also sent to it, see stream.py
+        self.stream: Stream | None = None
+
+    def __enter__(self) -> 'Filter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.buffer_out.close()
+        self.buffer_sync.close()
+
+    def copy_buffers(self, file_out: TextIO, file_sync: IO) -> None:
+        # append the filtered timeline to the files, chunk by chunk
+        for buffer, file in ((self.buffer_out, file_out),
+                             (self.buffer_sync, file_sync)):
+            buffer.seek(0)
+            copyfileobj(buffer, file, CHUNK_SIZE)
 
     def filter(self, file_in: Iterable[str]) -> None:
-        self.traverse(file_in)
+        self.filter_elements(self.parse_lines(file_in, -1))
+
+    def filter_replayed(self, elements: Sequence[Element]) -> None:
+        self.filter_elements(self.replay(elements))
+
+    def filter_elements(self, elements: Iterable[Element]) -> None:
+        self.traverse_elements(elements)
+        self.finish()
+
+    def finish(self) -> None:
         # if some information has been omitted after the last printed
         # element, print an ellipse
         if self.omitted_linenumbers:
@@ -83,14 +150,7 @@ class Filter(Traverser):
             self.matched_date = False
 
     def fuzzysearch(self, string: str) -> int:
-        ratio = fuzz.partial_ratio(
-            self.find, string if config.CaseSensitiveSearch else string.lower()
-        )
-        # the maximum ratio is 100
-        if ratio >= config.FuzzySearchTolerance:
-            # when sorting in the end, lower values take priority
-            return 101 - ratio
-        return 0
+        return self.matchers[0].search(string)
 
     def handle_enter(self, enter: Enter) -> None:
         # Even if we are in matched mode and print everything, it is necessary
@@ -115,10 +175,7 @@ class Filter(Traverser):
             enter.printed = True
             self.matched_enters.add(enter.linenumber)
         if distance:
-            for description in enter.descriptions:
-                self.descriptions.append(DescriptionEntry(
-                    distance, enter.name, enter.linenumber, description
-                ))
+            self.add_descriptions(distance, enter)
 
     def handle_leave_matched(self, leave: Leave, enter: Enter) -> None:
         # This method is called during the loop in Traverser.block_leave()
@@ -205,10 +262,15 @@ class Filter(Traverser):
                 (description.linenumber, description.get_indent())
             )
         if distance:
-            for desc in description.descriptions:
-                self.descriptions.append(DescriptionEntry(
-                    distance, description.name, description.linenumber, desc
-                ))
+            self.add_descriptions(distance, description)
+
+    def add_descriptions(self, distance: int,
+                         block: Enter | Description) -> None:
+        # copy the descriptions of a matched name to the header
+        for description in block.descriptions:
+            self.descriptions.append(DescriptionEntry(
+                distance, block.name, block.linenumber, description
+            ))
 
     def handle_note(self, note: Note) -> None:
         if self.matched_date:
@@ -317,8 +379,13 @@ class Filter(Traverser):
 
     def print_atom(self, element: Element) -> None:
         # elementary print method, the only one that actually prints
-        print(element, file=self.buffer_out)
-        print(element.get_sync(), file=self.buffer_sync)
+        text = str(element)
+        linenumbers = element.get_sync_range()
+        print(text, file=self.buffer_out)
+        self.buffer_sync.write(self.sync_format.link(linenumbers,
+                                                     element.SYNC_COLUMN))
+        if self.stream is not None:
+            self.stream.add(text, linenumbers, element.SYNC_COLUMN)
         self.last_printed_element = element
 
     def set_indent(self, date: Date, indent: int) -> None:
@@ -327,6 +394,567 @@ class Filter(Traverser):
         else:
             date.indent = indent
 
+    def get_printing_state(self) -> tuple:
+        # everything besides Traverser.get_state() needed to resume filtering
+        # on the next element
+        return (self.date_printed, self.last_printed_element,
+                self.omitted_linenumbers, self.matched_date,
+                self.matched_enters)
+
+    def set_printing_state(self, state: tuple) -> None:
+        (self.date_printed, self.last_printed_element,
+         self.omitted_linenumbers, self.matched_date,
+         self.matched_enters) = state
+
+    def get_fingerprint(self) -> tuple:
+        # The state deciding the output from the next element on, comparable
+        # between filters traversing different copies of the elements.
+        last = self.last_printed_element
+        return (
+            get_date_key(self.date), self.date.indent,
+            self.date.empty_line and self.date.empty_line.linenumber,
+            get_date_key(self.date_printed),
+            last and (type(last), last.linenumber, last.get_indent()),
+            tuple(self.omitted_linenumbers), self.matched_date,
+            frozenset(self.matched_enters),
+            tuple(map(get_block_key, self.blocks.values())),
+        )
+
+
+def get_date_key(date: Date) -> tuple:
+    return date.day, date.month, date.year
+
+
+def get_block_key(block: Block) -> tuple:
+    if isinstance(block, Enter):
+        return (block.linenumber, block.printed, block.waiting,
+                tuple(leave.linenumber for leave in block.waited_by))
+    # noinspection PyUnresolvedReferences
+    return (block.linenumber, block.linenumber_enter,
+            frozenset(block.waiting_for))
+
+
+def iter_searchables(elements: Sequence[Element])\
+        -> Iterator[tuple[int, tuple[str, ...]]]:
+    # the indices of the elements fuzzysearch() is called for during
+    # the traversal, each with the strings it is called with
+    # only used to get the canonical dates the same way handle_date() does
+    dates = Traverser()
+    for index, element in enumerate(elements):
+        if isinstance(element, Note):
+            yield index, (element.searchable,)
+        elif isinstance(element, (Enter, Description)):
+            yield index, (element.name, element.line)
+        elif isinstance(element, Date):
+            dates.handle_date(element)
+            yield index, (str(dates.date),)
+        elif isinstance(element, Command):
+            element.apply(dates)
+
+
+class BatchFilter(Filter):
+    """
+    Filter that scores all the searchable strings of the timeline in a single
+    batch before traversing it. The fuzzy matchers spread the batch across
+    'workers' threads (-1 means one per CPU) if numpy is available.
+    """
+    def __init__(self, find: str, matcher: str | None = None,
+                 sync_format: str | None = None, workers: int = -1,
+                 layout: Layout | None = None) -> None:
+        super(BatchFilter, self).__init__(find, matcher, sync_format, layout)
+        self.workers = workers
+        # the results of fuzzysearch() for each searchable string
+        self.distances: dict[str, int] = {}
+
+    def replay(self, elements: Sequence[Element], max_lines: int = -1)\
+            -> Iterator[Element]:
+        self.score(self.get_searchables(elements))
+        return super(BatchFilter, self).replay(elements, max_lines)
+
+    @staticmethod
+    def get_searchables(elements: Sequence[Element]) -> set[str]:
+        # collect every string fuzzysearch() will be called with during
+        # the traversal of the elements
+        return {string for _, strings in iter_searchables(elements)
+                for string in strings}
+
+    def score(self, searchables: set[str]) -> None:
+        strings = list(searchables)
+        self.distances = dict(zip(
+            strings, self.matchers[0].search_batch(strings, self.workers)
+        ))
+
+    def fuzzysearch(self, string: str) -> int:
+        distance = self.distances.get(string)
+        if distance is None:
+            return super(BatchFilter, self).fuzzysearch(string)
+        return distance
+
+
+class StaleError(Exception):
+    pass
+
+
+class LiveFilter(BatchFilter):
+    """
+    Filter of the live search, which filters the timeline again whenever its
+    term changes. The searchable strings are scored by a LiveSearch kept
+    between the terms (see matcher.py) and the traversal is stopped by
+    StaleError as soon as stale() tells that the result is not wanted anymore.
+    The content of the timeline is identified by key, so that its searchable
+    strings are only collected again when it changes.
+    """
+    def __init__(self, find: str, matcher: str | None, sync_format: str | None,
+                 workers: int, layout: Layout | None, search: LiveSearch,
+                 stale: Callable[[], bool], key: tuple) -> None:
+        super(LiveFilter, self).__init__(find, matcher, sync_format, workers,
+                                         layout)
+        self.search = search
+        self.stale = stale
+        self.key = key
+
+    def replay(self, elements: Sequence[Element], max_lines: int = -1)\
+            -> Iterator[Element]:
+        self.distances = self.search.search(
+            self.matchers[0], self.key,
+            lambda: self.get_searchables(elements), self.workers
+        )
+        for index, element in enumerate(
+                super(BatchFilter, self).replay(elements, max_lines)):
+            if not index % STALE_INTERVAL and self.stale():
+                raise StaleError(f'stopped filtering {self.matchers[0].find}')
+            yield element
+
+
+class RankedFilter(Filter):
+    """
+    Filter printing only the top elements closest to the term, ties going to
+    the earlier ones. Each of them is printed with its date and the blocks it
+    is located in, but without the rest of its context. The elements are
+    ranked before the traversal, keeping the best ones found so far in a heap.
+    Once the heap is full, the matcher only needs to tell the strings closer
+    than the worst of them (see Matcher.narrow()), and once they are all at
+    the smallest distance, no later element can replace them and the ranking
+    stops. The traversal stops when the blocks around the last of them are
+    closed.
+    """
+    def __init__(self, find: str, matcher: str | None = None,
+                 sync_format: str | None = None, top: int = 1,
+                 layout: Layout | None = None) -> None:
+        super(RankedFilter, self).__init__(find, matcher, sync_format, layout)
+        self.top = max(top, 1)
+        # the distances of the top elements, by their ids
+        self.hits: dict[int, int] = {}
+
+    def filter_replayed(self, elements: Sequence[Element]) -> None:
+        last = self.rank(elements)
+        self.filter_elements(self.until_closed(self.replay(elements),
+                                               elements, last))
+
+    def rank(self, elements: Sequence[Element]) -> int:
+        # find the top elements, return the index of the last one or -1
+        matcher = self.matchers[0]
+        # the strings may repeat, e.g. the names of the blocks
+        distances: dict[str, int] = {}
+        # (-distance, -index) of the top elements found so far, the worst one
+        # first
+        heap: list[tuple[int, int]] = []
+        for index, strings in iter_searchables(elements):
+            for string in strings:
+                if string not in distances:
+                    distances[string] = matcher.search(string)
+            distance = min(filter(None, map(distances.get, strings)),
+                           default=0)
+            if not distance:
+                continue
+            if len(heap) < self.top:
+                heapq.heappush(heap, (-distance, -index))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, -index))
+            else:
+                continue
+            if len(heap) == self.top:
+                if heap[0][0] == -1:
+                    # nothing can be closer than the worst one
+                    break
+                matcher.narrow(-heap[0][0])
+        self.hits = {id(elements[-index]): -distance
+                     for distance, index in heap}
+        return max((-index for _, index in heap), default=-1)
+
+    def until_closed(self, replayed: Iterable[Element],
+                     elements: Sequence[Element],
+                     last: int) -> Iterator[Element]:
+        # yield the replayed elements up to the last hit and then until no
+        # printed block is open, the rest of the elements is omitted
+        for index, element in enumerate(replayed):
+            if index > last and not any(
+                    isinstance(block, Leave) or block.printed
+                    for block in self.blocks.values()):
+                omitted = next((
+                    elements[following]
+                    for following in range(index, len(elements))
+                    if isinstance(elements[following], Dated)
+                ), None)
+                if omitted is not None:
+                    self.omitted_linenumbers.append(
+                        (omitted.linenumber, omitted.get_indent())
+                    )
+                return
+            yield element
+
+    def handle_date(self, date: Date) -> None:
+        self.date = self.date.update(
+            date, isinstance(self.last_parsed, Date) and self.last_parsed >
+            self.date_printed
+        )
+        if id(date) in self.hits:
+            # print the open blocks, but not the whole day
+            self.print_structured(self.date)
+            self.date_printed = self.date
+
+    def handle_enter(self, enter: Enter) -> None:
+        # a hit is printed, but not the block it enters
+        if id(enter) in self.hits:
+            self.print_structured_dated(enter)
+            enter.printed = True
+            self.add_descriptions(self.hits[id(enter)], enter)
+
+    def handle_description(self, description: Description) -> None:
+        if id(description) in self.hits:
+            self.print_structured_dated(description)
+            self.add_descriptions(self.hits[id(description)], description)
+        else:
+            self.omitted_linenumbers.append(
+                (description.linenumber, description.get_indent())
+            )
+
+    def handle_note(self, note: Note) -> None:
+        if id(note) in self.hits:
+            self.print_structured_dated(note)
+        else:
+            self.omitted_linenumbers.append(
+                (note.linenumber, note.get_indent())
+            )
+
+
+class QueryFilter(Filter):
+    """
+    Filter by a boolean query of several terms, see query.py. A term is found in
+    an element if it is found in the element itself, in an open block or in
+    the current date, following the context rules of filtering by the term
+    alone. This way, a single traversal intersects the results of filtering by
+    each of the terms.
+    """
+    def __init__(self, find: str, matcher: str | None = None,
+                 sync_format: str | None = None,
+                 layout: Layout | None = None) -> None:
+        super(QueryFilter, self).__init__(find, matcher, sync_format, layout)
+        self.query = query.parse(find)
+        self.matchers = [self.matcher_class(term.text)
+                         for term in self.query.get_terms()]
+        # distances of the terms found in the open blocks, by linenumbers
+        self.block_distances: dict[int, list[int]] = {}
+        # distances of the terms found in the current date
+        self.date_distances = [0] * len(self.matchers)
+        # the best distances of the terms found in the open blocks or the date
+        self.context_distances = self.date_distances
+        # distances of the terms found in the last searched string itself
+        self.last_distances = self.date_distances
+        # distances of the terms by the strings of the current element, each
+        # of them is searched once
+        self.element_distances: dict[str, list[int]] = {}
+
+    def search_terms(self, string: str) -> list[int]:
+        if string not in self.element_distances:
+            self.element_distances[string] = [matcher.search(string)
+                                              for matcher in self.matchers]
+        return self.element_distances[string]
+
+    def fuzzysearch(self, string: str) -> int:
+        self.last_distances = self.search_terms(string)
+        return self.query.evaluate([
+            min(distance, context) if distance and context
+            else distance or context
+            for distance, context in zip(self.last_distances,
+                                         self.context_distances)
+        ])
+
+    def update_context(self) -> None:
+        self.context_distances = [
+            min(filter(None, distances), default=0) for distances in
+            zip(self.date_distances, *self.block_distances.values())
+        ]
+
+    def handle_date(self, date: Date) -> None:
+        self.element_distances.clear()
+        # the terms found in the previous date don't apply to this one
+        self.date_distances = [0] * len(self.matchers)
+        self.update_context()
+        # the last searched string is the new date
+        super(QueryFilter, self).handle_date(date)
+        self.date_distances = self.last_distances
+        self.update_context()
+
+    def handle_enter(self, enter: Enter) -> None:
+        self.element_distances.clear()
+        super(QueryFilter, self).handle_enter(enter)
+        # the line contains the name, too
+        self.block_distances[enter.linenumber] = self.search_terms(enter.line)
+        self.update_context()
+
+    def handle_description(self, description: Description) -> None:
+        self.element_distances.clear()
+        super(QueryFilter, self).handle_description(description)
+
+    def handle_note(self, note: Note) -> None:
+        self.element_distances.clear()
+        super(QueryFilter, self).handle_note(note)
+
+    def add_descriptions(self, distance: int,
+                         block: Enter | Description) -> None:
+        # only copy the descriptions if some term is found in the name itself,
+        # not just in its context. The name has been searched already.
+        if any(self.search_terms(block.name)):
+            super(QueryFilter, self).add_descriptions(distance, block)
+
+    def handle_leave_matched(self, leave: Leave, enter: Enter) -> None:
+        super(QueryFilter, self).handle_leave_matched(leave, enter)
+        del self.block_distances[enter.linenumber]
+        self.update_context()
+
+
+# the elements filtered by ParallelFilter, inherited by its forked workers
+# instead of being pickled for each of them
+chunk_elements: Sequence[Element] = ()
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    # the fingerprint of ChunkFilter after traversing the element at index and
+    # the lengths of its output at that moment
+    index: int
+    state: tuple
+    out: int
+    sync: int
+    descriptions: int
+
+
+@dataclass(slots=True)
+class ChunkResult:
+    out: str
+    sync: str | bytes
+    descriptions: list[DescriptionEntry]
+    checkpoints: list[Checkpoint]
+    # the distances of the strings searched before the last checkpoint
+    distances: dict[str, int]
+    # Traverser.get_state() and Filter.get_printing_state() after the chunk
+    traversal: tuple
+    printing: tuple
+    scored: int
+    pruned: int
+
+
+class ChunkFilter(Filter):
+    """
+    Filter of a chunk of the elements, run in a worker process of
+    ParallelFilter. The chunk starts at a Date with no block open, so the only
+    state left by the previous chunks that it doesn't know is the state of
+    printing. It guesses that nothing has been printed or omitted since the
+    date before the chunk, and records its state after the first elements
+    that print something, for ParallelFilter to find where the guess stops
+    making a difference.
+    """
+    def __init__(self, find: str, matcher: str | None,
+                 sync_format: str | None, layout: Layout | None,
+                 date: Date) -> None:
+        super(ChunkFilter, self).__init__(find, matcher, sync_format, layout)
+        # the output of a chunk is kept in memory until it is sent back
+        self.buffer_out.close()
+        self.buffer_sync.close()
+        self.buffer_out = io.StringIO()
+        self.buffer_sync = io.BytesIO() if self.sync_format.MODE \
+            else io.StringIO()
+        self.date = self.date_printed = date
+        self.checkpoints: list[Checkpoint] = []
+        self.distances: dict[str, int] = {}
+
+    def fuzzysearch(self, string: str) -> int:
+        distance = super(ChunkFilter, self).fuzzysearch(string)
+        if len(self.checkpoints) <= CHECKPOINTS:
+            self.distances[string] = distance
+        return distance
+
+    def checkpoint(self, index: int) -> None:
+        self.checkpoints.append(Checkpoint(
+            index, self.get_fingerprint(), self.buffer_out.tell(),
+            self.buffer_sync.tell(), len(self.descriptions)
+        ))
+
+    def watch(self, elements: Iterable[Element], start: int)\
+            -> Iterator[Element]:
+        for index, element in enumerate(elements, start):
+            yield element
+            # the element has been traversed now
+            if len(self.checkpoints) <= CHECKPOINTS and self.buffer_out.tell():
+                self.checkpoint(index)
+
+    def filter_chunk(self, start: int, end: int) -> ChunkResult:
+        # the state before the first element
+        self.checkpoint(start - 1)
+        self.traverse_elements(self.watch(
+            self.replay(chunk_elements[start:end]), start
+        ))
+        return ChunkResult(
+            self.buffer_out.getvalue(), self.buffer_sync.getvalue(),
+            self.descriptions, self.checkpoints, self.distances,
+            self.get_state(), self.get_printing_state(),
+            self.matchers[0].scored, self.matchers[0].pruned
+        )
+
+
+def filter_chunk(task: tuple) -> ChunkResult:
+    start, end, date, find, matcher, sync_format, layout = task
+    with ChunkFilter(find, matcher, sync_format, layout, date) as filter_:
+        return filter_.filter_chunk(start, end)
+
+
+class ParallelFilter(Filter):
+    """
+    Filter that splits the elements into chunks and filters them in 'workers'
+    forked processes (-1 means one per CPU). The results of the chunks are
+    joined in order: this filter traverses the beginning of each chunk again,
+    from the true state left by the previous chunks, until its state matches
+    a state recorded by the worker. From then on, the output of the worker is
+    the same as the sequential output, so it is appended and the traversal
+    continues from the state of the worker after the chunk. A chunk that
+    prints nothing only adds to the omitted information.
+    """
+    # the output of the workers is appended without print_atom
+    STREAMS = False
+
+    def __init__(self, find: str, matcher: str | None = None,
+                 sync_format: str | None = None, workers: int = -1,
+                 layout: Layout | None = None) -> None:
+        super(ParallelFilter, self).__init__(find, matcher, sync_format,
+                                             layout)
+        self.processes = workers if workers > 0 else os.cpu_count() or 1
+        # the arguments of the workers besides the chunk
+        self.arguments = (find, matcher, sync_format, layout)
+        # the distances of the strings searched by the worker of the current
+        # chunk before its last checkpoint
+        self.distances: dict[str, int] = {}
+
+    def filter_replayed(self, elements: Sequence[Element]) -> None:
+        global chunk_elements
+        chunks = self.get_chunks(elements)
+        if len(chunks) < 2:
+            super(ParallelFilter, self).filter_replayed(elements)
+            return
+        chunk_elements = elements
+        try:
+            with multiprocessing.get_context('fork').Pool(
+                    self.processes) as pool:
+                results = pool.imap(filter_chunk, [
+                    (start, end, date, *self.arguments)
+                    for start, end, date in chunks
+                ])
+                for (start, end, _), result in zip(chunks, results):
+                    self.join(elements, start, end, result)
+        finally:
+            chunk_elements = ()
+        self.finish()
+
+    def get_chunks(self, elements: Sequence[Element])\
+            -> list[tuple[int, int, Date]]:
+        # Split the elements into chunks starting at Dates with no block open,
+        # that don't follow another Date, so that handle_date() doesn't keep
+        # the empty line of the previous date. Every Leave closes exactly one
+        # Enter, so it is enough to count them. Return the starts, the ends and
+        # the dates before the chunks.
+        size = max(MIN_CHUNK_ELEMENTS,
+                   len(elements) // (self.processes * CHUNKS_PER_WORKER))
+        chunks: list[tuple[int, int, Date]] = []
+        start = 0
+        open_blocks = 0
+        # only used to get the dates the same way the traversal does
+        dates = Traverser()
+        date = dates.date
+        for index, element in enumerate(elements):
+            if isinstance(element, Command):
+                element.apply(dates)
+                continue
+            if isinstance(element, Empty):
+                continue
+            if isinstance(element, Date):
+                if (index - start >= size and not open_blocks
+                        and not isinstance(dates.last_parsed, Date)):
+                    chunks.append((start, index, date))
+                    start = index
+                    date = dates.date
+                dates.date = dates.date.update(element)
+            elif isinstance(element, Enter):
+                open_blocks += 1
+            elif isinstance(element, Leave):
+                open_blocks -= 1
+            dates.last_parsed = element
+        chunks.append((start, len(elements), date))
+        return chunks
+
+    def join(self, elements: Sequence[Element], start: int, end: int,
+             result: ChunkResult) -> None:
+        self.matchers[0].scored += result.scored
+        self.matchers[0].pruned += result.pruned
+        if not result.out:
+            # Nothing is printed in the chunk whatever the state is, so
+            # the worker has omitted the same information, after the omitted
+            # information of the previous chunks.
+            _, _, omitted, matched_date, matched_enters = result.printing
+            self.set_printing_state((
+                self.date_printed, self.last_printed_element,
+                self.omitted_linenumbers + omitted, matched_date,
+                matched_enters
+            ))
+            self.set_state(result.traversal)
+            self.descriptions += result.descriptions
+            return
+        self.distances = result.distances
+        self.traverse_elements(self.resync(
+            self.replay(elements[start:end]), start, result
+        ))
+        self.distances = {}
+
+    def resync(self, elements: Iterable[Element], start: int,
+               result: ChunkResult) -> Iterator[Element]:
+        # yield the elements of the chunk until the state matches a checkpoint
+        # of the worker, then take the rest of the chunk from the worker
+        checkpoints = {checkpoint.index: checkpoint
+                       for checkpoint in result.checkpoints}
+        if self.try_join(checkpoints.get(start - 1), result):
+            return
+        for index, element in enumerate(elements, start):
+            yield element
+            # the element has been traversed now
+            if self.try_join(checkpoints.get(index), result):
+                return
+
+    def try_join(self, checkpoint: Checkpoint | None,
+                 result: ChunkResult) -> bool:
+        if checkpoint is None or checkpoint.state != self.get_fingerprint():
+            return False
+        self.buffer_out.write(result.out[checkpoint.out:])
+        self.buffer_sync.write(result.sync[checkpoint.sync:])
+        self.descriptions += result.descriptions[checkpoint.descriptions:]
+        self.set_state(result.traversal)
+        self.set_printing_state(result.printing)
+        return True
+
+    def fuzzysearch(self, string: str) -> int:
+        distance = self.distances.get(string)
+        if distance is None:
+            return super(ParallelFilter, self).fuzzysearch(string)
+        return distance
+
 
 def get_main_file(file: str, ignore_parent: bool) -> Path:
     # return path to the parent of 'file', in case 'file' was created as a
@@ -334,66 +962,171 @@ def get_main_file(file: str, ignore_parent: bool) -> Path:
     path_tln = Path(file).resolve()
     if ignore_parent:
         return path_tln
-    path_sync = path_tln.with_suffix('.sync')
     try:
-        with open(path_sync, 'r') as syncfile:
-            # second line contains the main .tln file from which 'file' was
-            # created as a filter result
-            syncfile.readline()
-            return Path(syncfile.readline().strip()).resolve()
+        # the syncfile contains the main .tln file from which 'file' was
+        # created as a filter result
+        return Path(open_sync(path_tln.with_suffix('.sync')).main_file)\
+            .resolve()
     except FileNotFoundError:
         # 'file' was not created as a filter result, hence it is the main file
         return path_tln
 
 
-def get_cache_dir() -> Path:
-    cache = Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser()
-    our_cache = cache / 'timeline'
-    our_cache.mkdir(exist_ok=True, parents=True)
-    return our_cache
-
-
 def get_tmp_file() -> Path:
     now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f-')
     return get_cache_dir() / now
 
 
 def prune_cache(keep) -> None:
-    # remove all directories in cache and all files above count and size, oldest
-    # first. Corresponding .tln and .sync files are counted as one file. keep is
-    # the basename of just-created files, which will be kept regardless of their
-    # size.
-    cache = get_cache_dir()
-    # basename: (size, timestamp, [path, ...])
-    info: dict[str, tuple[int, int, list]] = dict()
-    for child in cache.iterdir():
-        if not child.is_file():
-            child.unlink()
-        elif str(child).endswith('.sync') or str(child).endswith('.tln'):
-            basename = str(child).rsplit('.', 1)[0]
-            size, timestamp, files = info.get(basename, (0, 2**100, []))  # 2**100 is practically infinite
-            info[basename] = (
-                size + child.stat().st_size,
-                min(timestamp, child.stat().st_mtime_ns),
-                files + [child]
-            )
+    # record the result with the basename keep, which has just been created or
+    # reused, as the most recently used one and remove the least recently used
+    # results above count and size. Corresponding .tln and .sync files are
+    # counted as one result. keep is kept regardless of its size.
+    with Manifest() as manifest:
+        manifest.touch(keep)
+        manifest.evict(keep)
+
+
+def get_memo_query(find: str, batch: bool, matcher: str | None,
+                   sync_format: str | None,
+                   digests: tuple[tuple[str, str], ...] = (),
+                   top: int | None = None) -> tuple:
+    # everything the result of filter_file depends on, besides the content of
+    # the main file and the parent id, digests being the paths and content
+    # hashes of the included files. The term is kept as it is, the matchers
+    # and the heading of the result depend on its whitespace, too.
+    return (find, matcher or config.Matcher,
+            batch and not query.is_query(find), config.FuzzySearchTolerance,
+            config.CaseSensitiveSearch, config.Locale,
+            sync_format or config.SyncFormat, digests, top)
+
+
+def reuse_result(basename: str, parent_id: int | None) -> None:
+    # Save the parent id to the syncfile of the cached result and touch both
+    # files, so that even a rescan of the cache by Manifest treats the result
+    # as if it was just created.
+    path_sync = Path(f'{basename}.sync')
+    open_sync(path_sync).set_parent_id(parent_id)
+    for path in (Path(f'{basename}.tln'), path_sync):
+        os.utime(path)
+
+
+def filter_file(main_file: Path, find: str, parent_id: int | None,
+                get_elements: Callable[[list[Path]],
+                                       Sequence[Sequence[Element]]] | None,
+                batch: bool = False, workers: int = -1,
+                matcher: str | None = None,
+                sync_format: str | None = None, parallel: bool = False,
+                stream: TextIO | None = None, live: LiveSearch | None = None,
+                stale: Callable[[], bool] = lambda: False,
+                top: int | None = None) -> str:
+    # filter main_file together with the files it includes (see corpus.py),
+    # their elements returned by get_elements(files), save the result to
+    # the cache and return its basename. Without get_elements, main_file
+    # alone is memory-mapped and filtered while it is parsed. If the same
+    # filter has already been applied to the same content of the files and its
+    # result is still in the cache, that result is returned instead. If
+    # stream is given, the result is also streamed to it, see stream.py. If
+    # live is given, the strings are scored by it, reusing the scores of
+    # the previous term, and the filter stops when stale() becomes true. If top
+    # is given, only that many elements closest to the term are printed, see
+    # RankedFilter.
+    if get_elements is None or query.is_query(find):
+        # the elements are ranked before they are traversed
+        top = None
+    with profiling.phase('memo'):
+        files = [main_file] if get_elements is None \
+            else corpus.get_files(main_file)
+        memo = FilterMemo(main_file)
+        digests = corpus.get_digests(files[1:])
+        memo_query = get_memo_query(find, batch, matcher, sync_format,
+                                    digests, top)
+        tmp_file_basename = memo.lookup(memo_query)
+        if tmp_file_basename is not None:
+            reuse_result(tmp_file_basename, parent_id)
+            profiling.count('memo hits')
+            if stream is not None:
+                Stream(stream, main_file).send_result(tmp_file_basename)
+            return tmp_file_basename
+    tmp_file_basename = f'{get_tmp_file()}{find}'
+    elements: Sequence[Element] = ()
+    layout = None
+    if get_elements is not None:
+        with profiling.phase('parse cache'):
+            elements_of_files = get_elements(files)
+        if len(files) > 1:
+            with profiling.phase('merge'):
+                elements, layout = corpus.merge(files, elements_of_files)
         else:
-            child.unlink()
-    if keep in info:
-        count = 1
-        size_sum = info.pop(keep)[0]
+            elements = elements_of_files[0]
+    # create the filter before the files, so that an invalid query doesn't
+    # leave empty files behind
+    if query.is_query(find):
+        filter_ = QueryFilter(find, matcher, sync_format, layout)
+    elif top is not None:
+        filter_ = RankedFilter(find, matcher, sync_format, top, layout)
+    elif live is not None and get_elements is not None:
+        filter_ = LiveFilter(find, matcher, sync_format, workers, layout, live,
+                             stale, (memo.header['digest'], digests))
+    elif parallel and get_elements is not None:
+        filter_ = ParallelFilter(find, matcher, sync_format, workers, layout)
+    elif batch:
+        filter_ = BatchFilter(find, matcher, sync_format, workers, layout)
     else:
-        count = size_sum = 0
-    # iterate from newest and when we exceed size or count, delete everything
-    for basename, (size, _, paths) in sorted(
-            info.items(), key=lambda x: x[1][1], reverse=True
-    ):
-        size_sum += size
-        count += 1
-        if (size_sum > config.FilterHistorySize
-                or count > config.FilterHistoryCount):
-            for path in paths:
-                path.unlink()
+        filter_ = Filter(find, matcher, sync_format, layout)
+    if stream is not None and filter_.STREAMS:
+        filter_.stream = Stream(stream, main_file, layout)
+    # record the result before creating it, so that it gets pruned even if
+    # the filtering fails
+    with Manifest() as manifest:
+        manifest.add(tmp_file_basename)
+    profiling.instrument(filter_)
+    with (filter_,
+          open(f'{tmp_file_basename}.tln', 'w',
+               buffering=CHUNK_SIZE) as file_out,
+          open(f'{tmp_file_basename}.sync', f'w{filter_.sync_format.MODE}',
+               buffering=CHUNK_SIZE) as file_sync):
+        with profiling.phase('traverse'):
+            if get_elements is None:
+                with MappedLines(main_file) as lines:
+                    filter_.filter(lines)
+            else:
+                filter_.filter_replayed(elements)
+        # insert a heading to the top   TODO: comment syntax changed
+        title = [
+            f'{Syntax.COMMENT} {find}',
+            Syntax.COMMENT + Syntax.COMMENT[-1] * (len(find) + 2 + len(Syntax.COMMENT)),
+        ]
+        print(*title, sep='\n', file=file_out)
+        # if supplied, save an id of the parent kitty window to the syncfile,
+        # together with the name of the parent file
+        sync_format = filter_.sync_format
+        file_sync.write(sync_format.header(parent_id, main_file))
+        # print the description lines under the heading
+        descriptions = [
+            (f'{Syntax.COMMENT} {entry.name} = {entry.description}',
+             range(entry.linenumber, entry.linenumber + 1))
+            for entry in filter_.descriptions
+        ]
+        for text, linenumbers in descriptions:
+            print(text, file=file_out)
+            file_sync.write(sync_format.link(linenumbers))
+        # divide by an empty line, keeping the sync file synchronized
+        print(file=file_out)
+        file_sync.write(sync_format.unlinked())
+        if filter_.stream is not None:
+            # the filtered timeline has been streamed already, only the heading
+            # is missing
+            filter_.stream.send_heading([
+                *((text, None) for text in title), *descriptions, ('', None)
+            ])
+        # print the filtered timeline
+        with profiling.phase('write'):
+            filter_.copy_buffers(file_out, file_sync)
+    if stream is not None and filter_.stream is None:
+        Stream(stream, main_file).send_result(tmp_file_basename)
+    memo.record(memo_query, tmp_file_basename)
+    return tmp_file_basename
 
 
 def main():
@@ -414,49 +1147,117 @@ def main():
                              'created as a filter result')
     parser.add_argument('--parent-id', type=int, default=None,
                         help='kitty window id to be saved to the sync file')
+    parser.add_argument('--batch', action='store_true',
+                        help='score all the searchable strings in a single '
+                             'batch before filtering. Ignored for queries.')
+    parser.add_argument('--parallel', action='store_true',
+                        help='filter chunks of the timeline in parallel '
+                             'processes. Ignored for queries and with '
+                             '--mmap, takes precedence over --batch.')
+    parser.add_argument('--workers', type=int, default=-1,
+                        help='the number of threads scoring the batch (this '
+                             'requires numpy) or of the parallel processes, '
+                             '-1 means one per CPU')
+    parser.add_argument('--top', type=int, default=None, metavar='K',
+                        help='only print the K elements closest to the term, '
+                             'each with its date and blocks, instead of all '
+                             'the matches with their context. Ignored for '
+                             'queries and with --mmap.')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='filter in this process even if timelined is '
+                             'running')
+    parser.add_argument('--matcher', choices=MATCHERS, default=None,
+                        help='how to search for the term, see matcher.py. '
+                             'Overrides the configuration key Matcher.')
+    parser.add_argument('--sync-format', choices=SYNC_FORMATS, default=None,
+                        help='the format of the syncfile, see sync.py. '
+                             'Overrides the configuration key SyncFormat.')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory-map the file and filter it while it is '
+                             'parsed, without the daemon, the parse cache or '
+                             'the included files. Then --batch scores each '
+                             'string separately.')
+    parser.add_argument('--stream', action='store_true',
+                        help='print the result to stdout while it is being '
+                             'filtered, for the nvim integration (see '
+                             'stream.py), instead of opening it in nvim')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time of each phase and the counts of '
+                             'the key events to stderr')
+    parser.add_argument('--profile-dump', metavar='FILE',
+                        help='like --profile, and also save the cProfile '
+                             'statistics to FILE')
     parser.add_argument('find', nargs='*',
                         help='the search term to search for')
     args = parser.parse_args()
+    stream = None
+    if args.stream:
+        # stdout is left to the streamed result, print everything else to
+        # stderr
+        stream, sys.stdout = sys.stdout, sys.stderr
+    if args.profile or args.profile_dump:
+        profiling.start(args.profile_dump)
+        # the configuration has been read on import, read it again to time it
+        with profiling.phase('config'):
+            config.reload()
     find = ' '.join(args.find) or input('Enter filter phrase: ')
     print(args, find, sep='\n')
 
     # split into lines, strip leading and trailing whitespace and join with
     # spaces - this procedure makes a line from an indented paragraph
     find = ' '.join(map(str.strip, find.split('\n')))
+    # report an invalid query or regular expression before filtering
+    try:
+        terms = [term.text for term in query.parse(find).get_terms()] \
+            if query.is_query(find) else [find]
+        for term in terms:
+            MATCHERS[args.matcher or config.Matcher](term)
+    except query.QuerySyntaxError as e:
+        parser.error(str(e))
+    except re.error as e:
+        parser.error(f'invalid regular expression {e.pattern!r}: {e}')
     # get the path of the file to filter
     main_file = get_main_file(args.file, args.ignore_parent)
-    tmp_file_basename = f'{get_tmp_file()}{find}'
-
-    with (open(main_file, 'r') as file_in,
-          open(f'{tmp_file_basename}.tln', 'w') as file_out,
-          open(f'{tmp_file_basename}.sync', 'w') as file_sync):
-        filter_ = Filter(find)
-        filter_.filter(file_in)
-        # insert a heading to the top   TODO: comment syntax changed
-        print(f'{Syntax.COMMENT} {find}', file=file_out)
-        print(Syntax.COMMENT + Syntax.COMMENT[-1] * (len(find) + 2 + len(Syntax.COMMENT)), file=file_out)
-        # if supplied, print an id of the parent kitty window to the syncfile
-        print(args.parent_id if args.parent_id is not None else '',
-              file=file_sync)
-        # print the name of the parent file to the second line of the syncfile
-        print(main_file, file=file_sync)
-        # print the description lines under the heading
-        for entry in filter_.descriptions:
-            print(f'{Syntax.COMMENT} {entry.name} = {entry.description}', file=file_out)
-            print(entry.linenumber, file=file_sync)
-        # divide by an empty line, keeping the sync file synchronized
-        print(file=file_out)
-        print(file=file_sync)
-        # print the filtered timeline
-        print(filter_.buffer_out.getvalue(), end='', file=file_out)
-        print(filter_.buffer_sync.getvalue(), end='', file=file_sync)
+    response = None
+    if not (args.no_daemon or args.mmap):
+        with profiling.phase('request'):
+            response = daemon.request({
+                'command': 'filter',
+                'file': str(main_file),
+                'find': find,
+                'parent_id': args.parent_id,
+                'batch': args.batch,
+                'workers': args.workers,
+                'parallel': args.parallel,
+                'matcher': args.matcher,
+                'sync_format': args.sync_format,
+                'top': args.top,
+            })
+    if response is None:
+        # timelined is not running, filter the file ourselves
+        tmp_file_basename = filter_file(
+            main_file, find, args.parent_id,
+            None if args.mmap else corpus.load_parsed, args.batch,
+            args.workers, args.matcher, args.sync_format, args.parallel,
+            stream, top=args.top
+        )
+    else:
+        tmp_file_basename = response['basename']
+        if stream is not None:
+            Stream(stream, main_file).send_result(tmp_file_basename)
 
-    prune_cache(tmp_file_basename)
+    with profiling.phase('prune_cache'):
+        prune_cache(tmp_file_basename)
+    profiling.report()
 
-    if not args.debug:
+    if stream is not None:
+        Stream(stream, main_file).send({'done': tmp_file_basename})
+    elif not args.debug:
         # TIMELINE_INSTALL_DIR is a token that will be substituted by sed during
         # install time
-        os.system(f"nvim -R -u TIMELINE_INSTALL_DIR/lib/timeline/nvim.config '{tmp_file_basename}.tln'")
+        subprocess.run(['nvim', '-R', '-u',
+                        'TIMELINE_INSTALL_DIR/lib/timeline/nvim.config',
+                        f'{tmp_file_basename}.tln'])
 
 
 if __name__ == '__main__':
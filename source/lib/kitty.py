@@ -0,0 +1,187 @@
+"""
+Client of the kitty remote control protocol. Instead of starting 'kitten @' for
+every command, the commands are sent over the socket kitty listens on, given by
+the environment variable KITTY_LISTEN_ON (kitty has to be configured with
+allow_remote_control and listen_on). A batch of commands is sent over a single
+connection. Without the socket, each command falls back to 'kitten @'.
+
+Each command is an escape code wrapping a JSON object,
+    ESC P @kitty-cmd {"cmd": ..., "version": ..., "payload": ...} ESC \\
+and unless the command has no_response, kitty answers with
+    ESC P @kitty-cmd {"ok": ..., "data": ..., "error": ...} ESC \\
+See tools/kitty_mock.py for a server that can stand in for kitty.
+"""
+import base64
+import json
+import os
+import socket
+import subprocess
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+PREFIX = b'\x1bP@kitty-cmd'
+SUFFIX = b'\x1b\\'
+# the oldest kitty that understands all the commands used here, newer kitty
+# refuses commands from newer clients
+VERSION = (0, 26, 0)
+
+
+class KittyError(Exception):
+    pass
+
+
+@dataclass
+class Command:
+    name: str
+    payload: dict[str, Any]
+    # the arguments of the equivalent 'kitten @' command
+    argv: list[str] = field(default_factory=list)
+    no_response: bool = False
+
+    def encode(self) -> bytes:
+        return PREFIX + json.dumps({
+            'cmd': self.name,
+            'version': VERSION,
+            'no_response': self.no_response,
+            'payload': self.payload,
+        }).encode() + SUFFIX
+
+
+def send_text(match: str, text: str) -> Command:
+    data = base64.standard_b64encode(text.encode()).decode()
+    return Command(
+        'send-text', {'match': match, 'data': f'base64:{data}'},
+        # kitten interprets the escapes in the text
+        ['send-text', '--match', match,
+         text.encode('unicode_escape').decode()]
+    )
+
+
+def focus_window(match: str) -> Command:
+    return Command('focus-window', {'match': match},
+                   ['focus-window', '--match', match])
+
+
+def launch(args: list[str], type_: str = 'window', title: str | None = None,
+           cwd: str | None = None, hold: bool = False) -> Command:
+    payload: dict[str, Any] = {'args': args, 'type': type_, 'hold': hold}
+    argv = ['launch', f'--type={type_}']
+    if title is not None:
+        payload['window_title'] = title
+        argv.append(f'--title={title}')
+    if cwd is not None:
+        payload['cwd'] = cwd
+        argv.append(f'--cwd={cwd}')
+    if hold:
+        argv.append('--hold')
+    return Command('launch', payload, argv + args)
+
+
+class Client:
+    """
+    Connection to the socket of kitty at 'address', in the format of
+    KITTY_LISTEN_ON (unix:PATH, unix:@ABSTRACT or tcp:HOST:PORT). kitty may
+    close the connection after each command, then the client reconnects.
+    """
+    def __init__(self, address: str) -> None:
+        self.address = address
+        self.socket: socket.socket | None = None
+        # the number of commands sent over the current connection
+        self.sent = 0
+
+    def __enter__(self) -> 'Client':
+        self.connect()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def connect(self) -> None:
+        kind, _, rest = self.address.partition(':')
+        if kind == 'unix':
+            # the abstract namespace starts with a null byte
+            path = '\0' + rest[1:] if rest.startswith('@') else rest
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            target: Any = path
+        elif kind == 'tcp':
+            host, _, port = rest.rpartition(':')
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            target = (host, int(port))
+        else:
+            raise KittyError(f'unsupported address {self.address!r}')
+        try:
+            self.socket.connect(target)
+        except OSError:
+            self.close()
+            raise
+        self.sent = 0
+
+    def close(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def send(self, command: Command) -> Any:
+        # send the command and return the data of the response
+        message = command.encode()
+        for retry in (False, True):
+            if self.socket is None:
+                self.connect()
+            reused = self.sent > 0
+            try:
+                self.socket.sendall(message)
+                self.sent += 1
+                if command.no_response:
+                    return None
+                response = self.receive()
+            except (BrokenPipeError, ConnectionResetError):
+                response = None
+            if response is not None:
+                break
+            # kitty has closed the connection, which is only expected if it
+            # has already been used
+            self.close()
+            if retry or not reused:
+                raise KittyError(f'{command.name}: no response from kitty')
+        if not response.get('ok'):
+            raise KittyError(f'{command.name}: {response.get("error")}')
+        return response.get('data')
+
+    def receive(self) -> dict[str, Any] | None:
+        # a single response, None if the connection got closed before it
+        data = b''
+        while not data.endswith(SUFFIX):
+            chunk = self.socket.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+        start = data.find(PREFIX)
+        if start < 0:
+            raise KittyError(f'malformed response {data!r}')
+        return json.loads(data[start + len(PREFIX):-len(SUFFIX)])
+
+    def batch(self, commands: Sequence[Command]) -> list[Any]:
+        return [self.send(command) for command in commands]
+
+
+def run(commands: Sequence[Command]) -> None:
+    # Run the commands over the socket of kitty if possible, otherwise by
+    # 'kitten @' one by one. The fallback is only used if the socket can't be
+    # connected to, so no command is ever run twice.
+    address = os.environ.get('KITTY_LISTEN_ON')
+    if address:
+        client = Client(address)
+        try:
+            client.connect()
+        except (OSError, ValueError, KittyError):
+            pass
+        else:
+            try:
+                client.batch(commands)
+            finally:
+                client.close()
+            return
+    for command in commands:
+        subprocess.run(['kitten', '@', *command.argv],
+                       stdout=subprocess.DEVNULL)
@@ -1,44 +1,66 @@
 #!/usr/bin/env python
 import argparse
-import linecache
-import subprocess
 import pathlib
 
+import kitty
+from sync import open_sync
+
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument('--reverse', action='store_true',
+                        help='print the lines of the filter result filename '
+                             'linked to the line of its timeline instead')
+    parser.add_argument('--source', default=None,
+                        help='with --reverse, the file of the corpus the line '
+                             'is in, by default the main file')
     parser.add_argument('filename')
     parser.add_argument('line', type=int)
-    parser.add_argument('column', type=int)
+    parser.add_argument('column', type=int, nargs='?', default=1)
     args = parser.parse_args()
 
     path_tln = pathlib.Path(args.filename)
     path_sync = path_tln.with_suffix('.sync')
     try:
-        source_line = int(linecache.getline(str(path_sync), args.line).strip())
-    except ValueError:
-        # the sync file doesn't exist or the particular line doesn't have a link
+        sync = open_sync(path_sync)
+    except (OSError, ValueError):
+        # the sync file doesn't exist
         return
-    try:
-        parent_window_id = int(linecache.getline(str(path_sync), 1).strip())
-    except ValueError:
-        # no parent window id is supplied, open the timeline in new tab
-        subprocess.run(
-            f"kitten @ launch --type=tab --title=timeline --cwd=current "
-            f"--hold timeline '+call cursor({source_line}, {args.column})'",
-            shell=True
-        )
+    if args.reverse:
+        source = args.source and str(pathlib.Path(args.source).resolve())
+        print(*sync.get_lines(args.line, source))
+        return
+    link = sync.get_link(args.line)
+    if link is None:
+        # the particular line doesn't have a link
+        return
+    source_line, column, source = link
+    column = column or args.column
+    cursor = f'+call cursor({source_line}, {column})'
+    if sync.parent_id is None:
+        # no parent window id is supplied, open the timeline in new tab. The
+        # cursor command is only recognized after the file.
+        kitty.run([kitty.launch(
+            ['timeline', source or sync.main_file, cursor],
+            'tab', title='timeline', cwd='current', hold=True
+        )])
         # todo: print the id of the opened window into syncfile for subsequent
         #  linking
     else:
-        # return vim in parent window to normal mode if not already there and
-        # then move cursor to the linked position
-        subprocess.run(f"kitten @ send-text --match id:{parent_window_id} "
-                       f"'\e{source_line}G{args.column}|'",
-                       shell=True)
-        # switch to the tab containing the parent window
-        subprocess.run(f"kitty @ focus-window --match id:{parent_window_id}",
-                       shell=True)
+        match = f'id:{sync.parent_id}'
+        edit = ''
+        if source is not None:
+            # the result of a corpus links to several files, open the linked
+            # one in the parent window first
+            path = source.replace(' ', r'\ ')
+            edit = f':edit {path}\r'
+        kitty.run([
+            # return vim in parent window to normal mode if not already there
+            # and then move cursor to the linked position
+            kitty.send_text(match, f'\x1b{edit}{source_line}G{column}|'),
+            # switch to the tab containing the parent window
+            kitty.focus_window(match),
+        ])
 
 
 if __name__ == '__main__':
@@ -1,29 +1,28 @@
 #!/usr/bin/env python
+# imported first, to time the other imports
+import profiling
 import argparse
 from functools import partial
+from io import StringIO
+from pathlib import Path
 
 from traverser import Traverser, Date
+from cache import CheckpointIndex
+from config import config
+import daemon
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('filename')
-    parser.add_argument('line', type=int)
-    parser.add_argument('--generate-date', action='store_true')
-    args = parser.parse_args()
-
-    with open(args.filename, 'r') as file_in:
-        traverser = Traverser()
-        traverser.traverse(file_in, args.line)
-
-    if args.generate_date:
+def get_output(traverser: Traverser, generate_date: bool) -> str:
+    # the output for a traverser that stopped at the requested line
+    out = StringIO()
+    if generate_date:
         tomorrow = traverser.date.tomorrow()
         tomorrow.indent = traverser.last_parsed.get_indent()
-        print(tomorrow)
+        print(tomorrow, file=out)
     else:
         # all printing will begin with \n instead of ending, it generates better
         # output in vim
-        myprint = partial(print, '\n', sep='', end='')
+        myprint = partial(print, '\n', sep='', end='', file=out)
         date_printed = Date()
         for enter in traverser.blocks.values():
             # FIXME: this condition breaks when dates reset
@@ -33,6 +32,50 @@ def main():
             myprint(enter)
         if traverser.date > date_printed:
             myprint(traverser.date)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename')
+    parser.add_argument('line', type=int)
+    parser.add_argument('--generate-date', action='store_true')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='traverse the file in this process even if '
+                             'timelined is running')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time of each phase and the counts of '
+                             'the key events to stderr')
+    parser.add_argument('--profile-dump', metavar='FILE',
+                        help='like --profile, and also save the cProfile '
+                             'statistics to FILE')
+    args = parser.parse_args()
+    if args.profile or args.profile_dump:
+        profiling.start(args.profile_dump)
+        # the configuration has been read on import, read it again to time it
+        with profiling.phase('config'):
+            config.reload()
+
+    response = None
+    if not args.no_daemon:
+        with profiling.phase('request'):
+            response = daemon.request({
+                'command': 'list',
+                'file': str(Path(args.filename).resolve()),
+                'line': args.line,
+                'generate_date': args.generate_date,
+            })
+    if response is None:
+        # timelined is not running, traverse the file ourselves
+        traverser = Traverser()
+        profiling.instrument(traverser)
+        with profiling.phase('traverse'):
+            CheckpointIndex(args.filename).traverse(traverser, args.line)
+        with profiling.phase('output'):
+            print(get_output(traverser, args.generate_date), end='')
+    else:
+        print(response['output'], end='')
+    profiling.report()
 
 
 if __name__ == '__main__':
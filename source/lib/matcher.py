@@ -0,0 +1,340 @@
+"""
+A matcher searches for a single term in the strings of a timeline. It returns
+the distance of the term from the string: 0 if the term wasn't found,
+otherwise a number between 1 and 100, lower for better matches. The fuzzy
+matchers return 101 - score, the other ones return 1 for every match.
+
+The matcher is chosen by the configuration key Matcher or by filter.py
+--matcher:
+- exact: the term is a substring of the string,
+- regex: the term is a regular expression found in the string,
+- token: every word of the term is a word of the string, in any order, with
+  the fuzzy tolerance,
+- soundex: every word of the term sounds like a word of the string,
+- fuzzy: the term approximately matches a substring of the string, the default.
+
+All of them respect CaseSensitiveSearch, except soundex, which ignores case.
+
+LiveSearch scores the searchable strings of a timeline for a term typed
+character by character, reusing the scores of the shorter terms.
+"""
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from functools import lru_cache
+
+from rapidfuzz import fuzz, process
+
+from config import config, MATCHER_NAMES
+
+
+@dataclass(slots=True)
+class Scores:
+    # the distances of a list of strings from the term find, as prepared by
+    # the matcher, and what the matcher needs to score the strings for
+    # an extension of the term, see Matcher.search_extended()
+    find: str
+    distances: list[int]
+    # for the fuzzy matchers, the number of characters each string has in
+    # common with the term, with multiplicity
+    common: list[int] | None = None
+
+
+class Matcher(ABC):
+    def __init__(self, find: str) -> None:
+        # the search term
+        self.find: str = self.prepare(find)
+        # the number of strings scored by the matcher and the number of those
+        # that skipped it, because they couldn't match
+        self.scored = 0
+        self.pruned = 0
+
+    @staticmethod
+    def prepare(string: str) -> str:
+        return string if config.CaseSensitiveSearch else string.lower()
+
+    @abstractmethod
+    def search(self, string: str) -> int:
+        raise NotImplementedError
+
+    def search_batch(self, strings: list[str], workers: int) -> list[int]:
+        # the distances of all the strings, in the same order
+        return [self.search(string) for string in strings]
+
+    def search_extended(self, choices: list[str], previous: Scores | None,
+                        workers: int) -> Scores:
+        # The distances of the choices, strings already prepared by
+        # prepare(), if the term extends the term of previous by some
+        # characters, previous being the scores of the same choices. By
+        # default, all the choices are scored again.
+        return Scores(self.find, self.search_batch(choices, workers))
+
+    def narrow(self, distance: int) -> None:
+        # From now on, only the distances below distance need to be exact,
+        # the others may be returned as 0. By default, they are all exact.
+        pass
+
+
+class ExactMatcher(Matcher):
+    def search(self, string: str) -> int:
+        self.scored += 1
+        return int(self.find in self.prepare(string))
+
+    def search_extended(self, choices: list[str], previous: Scores | None,
+                        workers: int) -> Scores:
+        if previous is None:
+            return super(ExactMatcher, self).search_extended(choices,
+                                                             previous, workers)
+        # a string containing the term contains its beginning, too
+        distances = [
+            distance and int(self.find in choice)
+            for choice, distance in zip(choices, previous.distances)
+        ]
+        found = len(choices) - previous.distances.count(0)
+        self.scored += found
+        self.pruned += len(choices) - found
+        return Scores(self.find, distances)
+
+
+class RegexMatcher(Matcher):
+    def __init__(self, find: str) -> None:
+        super(RegexMatcher, self).__init__(find)
+        self.pattern = re.compile(
+            find, re.NOFLAG if config.CaseSensitiveSearch else re.IGNORECASE
+        )
+
+    def search(self, string: str) -> int:
+        self.scored += 1
+        return int(self.pattern.search(string) is not None)
+
+
+class FuzzyMatcher(Matcher):
+    # the rapidfuzz scorer, see search_batch()
+    scorer = staticmethod(fuzz.partial_ratio)
+
+    def __init__(self, find: str) -> None:
+        super(FuzzyMatcher, self).__init__(find)
+        # character counts of the search term and the tolerance, used to bound
+        # the fuzzy score, see below_tolerance()
+        self.find_counts = tuple(Counter(self.find).items())
+        self.bound_factor = 2 * config.FuzzySearchTolerance - 1
+        # the scorer returns 0 for scores that would be rounded below tolerance
+        self.score_cutoff = config.FuzzySearchTolerance - 0.5
+
+    def search(self, string: str) -> int:
+        string = self.prepare(string)
+        if self.below_tolerance(string):
+            self.pruned += 1
+            return 0
+        self.scored += 1
+        return self.get_distance(
+            self.scorer(self.find, string, score_cutoff=self.score_cutoff)
+        )
+
+    def search_batch(self, strings: list[str], workers: int) -> list[int]:
+        # Score all the strings at once. The batch is spread across 'workers'
+        # threads (-1 means one per CPU) if numpy is available, otherwise it is
+        # scored in the calling thread.
+        choices = [self.prepare(string) for string in strings]
+        scores = [0.] * len(choices)
+        try:
+            import numpy
+        except ImportError:
+            # cdist() needs numpy, score in the calling thread instead
+            for _, score, index in process.extract(
+                    self.find, choices, scorer=self.scorer, processor=None,
+                    score_cutoff=self.score_cutoff, limit=None
+            ):
+                scores[index] = score
+        else:
+            scores = process.cdist(
+                [self.find], choices, scorer=self.scorer, processor=None,
+                score_cutoff=self.score_cutoff, dtype=numpy.float64,
+                workers=workers
+            )[0].tolist()
+        self.scored += len(choices)
+        return list(map(self.get_distance, scores))
+
+    def search_extended(self, choices: list[str], previous: Scores | None,
+                        workers: int) -> Scores:
+        # Only score the choices that can reach the tolerance by the bound of
+        # below_tolerance(), using the exact number of common characters c.
+        # Extending the term by a character adds one to c of a choice if and
+        # only if the choice has more of that character than the term before,
+        # so c is updated character by character from the previous term.
+        if previous is None or previous.common is None:
+            previous = Scores('', [], [0] * len(choices))
+        common = previous.common
+        for index in range(len(previous.find), len(self.find)):
+            char = self.find[index]
+            needed = self.find.count(char, 0, index + 1)
+            common = [count + (choice.count(char) >= needed)
+                      for count, choice in zip(common, choices)]
+        # c < k * m / (400 - k) is below tolerance, see below_tolerance()
+        k = self.bound_factor
+        length = len(self.find)
+        survivors = [
+            index for index, (count, choice) in enumerate(zip(common, choices))
+            if (400 - k) * count >= k * min(length, len(choice))
+        ]
+        distances = [0] * len(choices)
+        for index, distance in zip(survivors, self.search_batch(
+                [choices[index] for index in survivors], workers)):
+            distances[index] = distance
+        self.pruned += len(choices) - len(survivors)
+        return Scores(self.find, distances, common)
+
+    def narrow(self, distance: int) -> None:
+        # raise the tolerance to skip the strings at distance or further, both
+        # in the scorer and in below_tolerance()
+        tolerance = max(102 - distance, config.FuzzySearchTolerance)
+        self.bound_factor = 2 * tolerance - 1
+        self.score_cutoff = tolerance - 0.5
+
+    @staticmethod
+    def get_distance(score: float) -> int:
+        ratio = round(score)
+        # the maximum ratio is 100
+        if ratio >= config.FuzzySearchTolerance:
+            # when sorting in the end, lower values take priority
+            return 101 - ratio
+        return 0
+
+    def below_tolerance(self, string: str) -> bool:
+        # Cheap upper bound on partial_ratio, which is the best ratio of
+        # the shorter string and a substring of the longer one of length at most
+        # the length m of the shorter string. The ratio is 200 * l / (m + n),
+        # where l is the length of their longest common subsequence and n is
+        # the length of the substring. Both l <= n and l <= c, where c is
+        # the number of characters the strings have in common (with
+        # multiplicity), so the ratio is at most 200 * c / (m + c).
+        shorter = min(len(self.find), len(string))
+        if not shorter:
+            # two empty strings match perfectly
+            return False
+        # The score gets rounded, so it is below tolerance if the bound is
+        # below tolerance - 0.5, i.e. if c < k * m / (400 - k) for
+        # k = 2 * tolerance - 1. Counting the characters is slower than
+        # the scorer itself, so only count the characters of the search term
+        # missing in the string altogether and stop when there are too many.
+        k = self.bound_factor
+        if k <= 0:
+            return False
+        if k >= 400:
+            return True
+        allowed = len(self.find) + (k * shorter) // (k - 400)
+        missing = 0
+        for char, count in self.find_counts:
+            if char not in string:
+                missing += count
+                if missing > allowed:
+                    return True
+        return allowed < 0
+
+
+class TokenMatcher(FuzzyMatcher):
+    # token_set_ratio is 100 whenever the words of one string are a subset of
+    # the words of the other one
+    scorer = staticmethod(fuzz.token_set_ratio)
+    WORD = re.compile(r'\w+')
+
+    @classmethod
+    def prepare(cls, string: str) -> str:
+        # the words without punctuation
+        return ' '.join(cls.WORD.findall(super().prepare(string)))
+
+    def below_tolerance(self, string: str) -> bool:
+        # the bound of partial_ratio doesn't hold for token_set_ratio
+        return False
+
+    def search_extended(self, choices: list[str], previous: Scores | None,
+                        workers: int) -> Scores:
+        # neither does the bound of FuzzyMatcher.search_extended()
+        return super(FuzzyMatcher, self).search_extended(choices, None,
+                                                         workers)
+
+
+class SoundexMatcher(Matcher):
+    CODES = dict.fromkeys('bfpv', '1') | dict.fromkeys('cgjkqsxz', '2') \
+        | dict.fromkeys('dt', '3') | {'l': '4', 'm': '5', 'n': '5', 'r': '6'}
+
+    def __init__(self, find: str) -> None:
+        super(SoundexMatcher, self).__init__(find)
+        self.find_codes = self.get_codes(find)
+
+    def search(self, string: str) -> int:
+        self.scored += 1
+        return int(self.find_codes <= self.get_codes(string))
+
+    @classmethod
+    def get_codes(cls, string: str) -> frozenset[str]:
+        return frozenset(filter(None, map(cls.soundex, string.split())))
+
+    # the words repeat a lot, but timelined would keep every one of them
+    # with an unbounded cache
+    @classmethod
+    @lru_cache(maxsize=1 << 16)
+    def soundex(cls, word: str) -> str:
+        # American Soundex of the word, empty if it has no Latin letters
+        letters = [
+            char for char in unicodedata.normalize('NFKD', word.lower())
+            if 'a' <= char <= 'z'
+        ]
+        if not letters:
+            return ''
+        code = letters[0].upper()
+        last = cls.CODES.get(letters[0], '')
+        for char in letters[1:]:
+            digit = cls.CODES.get(char, '')
+            if digit and digit != last:
+                code += digit
+            # h and w don't separate letters with the same code, vowels do
+            if char not in 'hw':
+                last = digit
+        return (code + '000')[:4]
+
+
+class LiveSearch:
+    """
+    The scores of the searchable strings of a timeline for the terms typed
+    one character after another, kept between the searches. A term
+    extending the previous one only scores the strings that may still match
+    it (see Matcher.search_extended()) and the scores of the shorter terms are
+    kept until a term that doesn't extend them is searched, so deleting
+    characters scores nothing. When the timeline changes, it starts over.
+    """
+    def __init__(self) -> None:
+        # identifies the content of the timeline the strings are from
+        self.key: Hashable = None
+        self.strings: list[str] = []
+        # the strings prepared by the matcher
+        self.choices: list[str] = []
+        # the scores of the strings for terms, each extending the previous one
+        self.stack: list[Scores] = []
+
+    def search(self, matcher: Matcher, key: Hashable,
+               get_searchables: Callable[[], set[str]],
+               workers: int) -> dict[str, int]:
+        # the distances of the searchable strings of the timeline identified by
+        # key from the term of the matcher
+        if key != self.key:
+            self.key = key
+            self.strings = list(get_searchables())
+            self.choices = list(map(matcher.prepare, self.strings))
+            self.stack.clear()
+        while self.stack and not matcher.find.startswith(self.stack[-1].find):
+            self.stack.pop()
+        if not self.stack or self.stack[-1].find != matcher.find:
+            self.stack.append(matcher.search_extended(
+                self.choices, self.stack[-1] if self.stack else None, workers
+            ))
+        return dict(zip(self.strings, self.stack[-1].distances))
+
+
+# the matcher of each name is the class <Name>Matcher
+MATCHERS: dict[str, type[Matcher]] = {
+    name: globals()[f'{name.capitalize()}Matcher'] for name in MATCHER_NAMES
+}
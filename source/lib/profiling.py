@@ -0,0 +1,173 @@
+"""
+Profiling of filter.py and list.py, enabled by their --profile flag. The
+report lists the wall and CPU time of each phase and the counts of the key
+events. The time of a phase doesn't include the phases nested in it, so
+the time of 'traverse' is the time of the filter's state machine itself, not
+of parsing the lines or scoring the strings. With --profile-dump, the whole run
+is profiled by cProfile, too.
+
+Unless start() is called, phase() returns a null context and instrument()
+does nothing, so the program runs exactly as without the profiling. The
+counters are installed by instrument() as wrappers of the methods of
+the particular Traverser and its matchers, not in the methods themselves.
+"""
+import cProfile
+import sys
+import time
+from collections import Counter
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Any, ContextManager
+
+# the time this module was imported, before the rest of the program
+IMPORTED = (time.perf_counter(), time.process_time())
+
+
+class Profiler:
+    def __init__(self, dump: str | None = None) -> None:
+        # wall and CPU time of the phases, by names
+        self.times: dict[str, list[float]] = {}
+        self.counts: Counter[str] = Counter()
+        self.maxima: dict[str, int] = {}
+        # the instrumented matchers, which count the calls of their scorers
+        self.matchers: list[Any] = []
+        # the running phases, [name, wall, cpu, nested wall, nested cpu]
+        self.stack: list[list] = []
+        self.dump = dump
+        self.profile = cProfile.Profile() if dump else None
+        if self.profile:
+            self.profile.enable()
+        self.stack.append(['import', *IMPORTED, 0., 0.])
+        self.end()
+
+    def begin(self, name: str) -> None:
+        self.stack.append(
+            [name, time.perf_counter(), time.process_time(), 0., 0.]
+        )
+
+    def end(self) -> None:
+        name, wall, cpu, nested_wall, nested_cpu = self.stack.pop()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        times = self.times.setdefault(name, [0., 0.])
+        times[0] += wall - nested_wall
+        times[1] += cpu - nested_cpu
+        if self.stack:
+            self.stack[-1][3] += wall
+            self.stack[-1][4] += cpu
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def maximum(self, name: str, value: int) -> None:
+        if value > self.maxima.get(name, 0):
+            self.maxima[name] = value
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        # the function counted and timed as the phase 'name'
+        @wraps(function)
+        def wrapper(*args, **kwargs) -> Any:
+            self.counts[name] += 1
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def iterated(self, name: str, function: Callable[..., Iterator],
+                 sample: Callable[[], None]) -> Callable[..., Iterator]:
+        # The function returning an iterator of elements, timed as the phase
+        # 'name' whenever the iterator is advanced. The elements are counted
+        # by type and sample() is called after each of them is traversed.
+        @wraps(function)
+        def wrapper(*args, **kwargs) -> Iterator:
+            with self.phase(name):
+                iterator = iter(function(*args, **kwargs))
+            while True:
+                self.begin(name)
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.end()
+                self.counts[f'elements {type(element).__name__}'] += 1
+                yield element
+                sample()
+        return wrapper
+
+    def instrument(self, traverser: Any) -> None:
+        # count and time the hot paths of the traverser, which is usually
+        # a Filter
+        def sample() -> None:
+            self.maximum('blocks', len(traverser.blocks))
+            if hasattr(traverser, 'omitted_linenumbers'):
+                self.maximum('omitted_linenumbers',
+                             len(traverser.omitted_linenumbers))
+
+        traverser.parse_lines = self.iterated('parse', traverser.parse_lines,
+                                              sample)
+        traverser.replay = self.iterated('replay', traverser.replay, sample)
+        for name in ('print_atom', 'print_structure'):
+            if hasattr(traverser, name):
+                setattr(traverser, name,
+                        self.timed(name, getattr(traverser, name)))
+        self.matchers += getattr(traverser, 'matchers', ())
+        for matcher in getattr(traverser, 'matchers', ()):
+            matcher.search = self.timed('score', matcher.search)
+            matcher.search_batch = self.timed('score batch',
+                                              matcher.search_batch)
+
+    def report(self) -> None:
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(self.dump)
+        file = sys.stderr
+        print(f'{"phase":24} {"wall [s]":>10} {"cpu [s]":>10}', file=file)
+        for name, (wall, cpu) in self.times.items():
+            print(f'{name:24} {wall:10.4f} {cpu:10.4f}', file=file)
+        total = [sum(times) for times in zip(*self.times.values())]
+        print(f'{"total":24} {total[0]:10.4f} {total[1]:10.4f}', file=file)
+        for name, count in sorted(self.counts.items()):
+            print(f'{name + " calls" if name in self.times else name:40} '
+                  f'{count:10}', file=file)
+        for name, value in self.maxima.items():
+            print(f'{"max " + name:40} {value:10}', file=file)
+        if self.matchers:
+            print(f'{"scorer calls":40} '
+                  f'{sum(matcher.scored for matcher in self.matchers):10}',
+                  file=file)
+            print(f'{"scorer calls avoided":40} '
+                  f'{sum(matcher.pruned for matcher in self.matchers):10}',
+                  file=file)
+
+
+profiler: Profiler | None = None
+
+
+def start(dump: str | None = None) -> None:
+    global profiler
+    profiler = Profiler(dump)
+
+
+def phase(name: str) -> ContextManager:
+    return profiler.phase(name) if profiler else nullcontext()
+
+
+def count(name: str) -> None:
+    if profiler:
+        profiler.counts[name] += 1
+
+
+def instrument(traverser: Any) -> None:
+    if profiler:
+        profiler.instrument(traverser)
+
+
+def report() -> None:
+    if profiler:
+        profiler.report()
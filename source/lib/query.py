@@ -0,0 +1,221 @@
+"""
+A boolean query combines several search terms by the operators AND, OR and NOT
+and by parentheses, for example '?ogre AND (tavern OR inn) NOT dream'. It has
+to start with the prefix ?, any other text is searched for as a single term,
+so that searching for a selected text never makes a query of it. The
+operators have to be uppercase. NOT binds the tightest, then AND, then OR. Two
+consecutive operands without an operator between them are joined by AND, while
+consecutive words form a single term, so 'red dragon AND inn' searches for
+'red dragon' and 'inn'. A quoted string is always a part of a term, so "AND"
+searches for the word itself, and it can't be empty.
+
+Each term is searched for separately and its distance (see
+Filter.fuzzysearch()) is 0 if it didn't match. The distance of a query is
+the worst distance of the operands of AND, the best distance of the operands
+of OR, and 0 whenever the query isn't satisfied.
+"""
+import re
+from abc import ABC, abstractmethod
+from collections.abc import Iterator, Sequence
+
+
+class QuerySyntaxError(Exception):
+    pass
+
+
+class Operator:
+    AND = 'AND'
+    OR = 'OR'
+    NOT = 'NOT'
+    OPEN = '('
+    CLOSE = ')'
+
+
+OPERATORS = (Operator.AND, Operator.OR, Operator.NOT, Operator.OPEN,
+             Operator.CLOSE)
+# the prefix of a query
+PREFIX = '?'
+# distance of a satisfied query that has no positive terms, e.g. 'NOT dream',
+# the worst possible one
+NEGATIVE_DISTANCE = 100
+TOKEN = re.compile(r'"(?P<quoted>[^"]*)"|(?P<paren>[()])|(?P<word>[^\s()"]+)'
+                   r'|(?P<unterminated>")')
+
+
+class Query(ABC):
+    @abstractmethod
+    def get_terms(self) -> Iterator['Term']:
+        raise NotImplementedError
+
+    @abstractmethod
+    def evaluate(self, distances: Sequence[int]) -> int:
+        # distances are indexed by Term.index
+        raise NotImplementedError
+
+
+class Term(Query):
+    def __init__(self, text: str) -> None:
+        self.text = text
+        # position in the list of terms of the whole query
+        self.index = 0
+
+    def get_terms(self) -> Iterator['Term']:
+        yield self
+
+    def evaluate(self, distances: Sequence[int]) -> int:
+        return distances[self.index]
+
+    def __repr__(self) -> str:
+        return repr(self.text)
+
+
+class Not(Query):
+    def __init__(self, operand: Query) -> None:
+        self.operand = operand
+
+    def get_terms(self) -> Iterator[Term]:
+        yield from self.operand.get_terms()
+
+    def evaluate(self, distances: Sequence[int]) -> int:
+        return 0 if self.operand.evaluate(distances) else NEGATIVE_DISTANCE
+
+    def __repr__(self) -> str:
+        return f'{Operator.NOT} {self.operand!r}'
+
+
+class And(Query):
+    def __init__(self, operands: list[Query]) -> None:
+        self.operands = operands
+
+    def get_terms(self) -> Iterator[Term]:
+        for operand in self.operands:
+            yield from operand.get_terms()
+
+    def evaluate(self, distances: Sequence[int]) -> int:
+        worst = 0
+        negative_only = True
+        for operand in self.operands:
+            distance = operand.evaluate(distances)
+            if not distance:
+                return 0
+            # a negation only decides whether the query is satisfied
+            if not isinstance(operand, Not):
+                worst = max(worst, distance)
+                negative_only = False
+        return NEGATIVE_DISTANCE if negative_only else worst
+
+    def __repr__(self) -> str:
+        return f'({f" {Operator.AND} ".join(map(repr, self.operands))})'
+
+
+class Or(Query):
+    def __init__(self, operands: list[Query]) -> None:
+        self.operands = operands
+
+    def get_terms(self) -> Iterator[Term]:
+        for operand in self.operands:
+            yield from operand.get_terms()
+
+    def evaluate(self, distances: Sequence[int]) -> int:
+        return min(
+            filter(None, (operand.evaluate(distances)
+                          for operand in self.operands)),
+            default=0
+        )
+
+    def __repr__(self) -> str:
+        return f'({f" {Operator.OR} ".join(map(repr, self.operands))})'
+
+
+def tokenize(text: str) -> Iterator[str | Term]:
+    # yield the operators as strings and the terms as Term instances
+    words: list[str] = []
+    for match in TOKEN.finditer(text):
+        if match['unterminated'] is not None:
+            raise QuerySyntaxError(f'unterminated quote in {text!r}')
+        if match['quoted'] == '':
+            # it would join the words around it by two spaces
+            raise QuerySyntaxError(f'empty quote in {text!r}')
+        token = match['paren'] or match['word']
+        if token in OPERATORS:
+            if words:
+                yield Term(' '.join(words))
+                words = []
+            yield token
+        else:
+            words.append(match['quoted'] if token is None else token)
+    if words:
+        yield Term(' '.join(words))
+
+
+def is_query(text: str) -> bool:
+    # whether the text starts with the prefix - otherwise it is a single term
+    # and should be searched for as it is
+    return text.lstrip().startswith(PREFIX)
+
+
+class Parser:
+    # recursive descent parser of the grammar
+    #   query := conjunction (OR conjunction)*
+    #   conjunction := negation (AND? negation)*
+    #   negation := NOT negation | ( query ) | term
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens = list(tokenize(text))
+        self.position = 0
+
+    def peek(self) -> str | Term | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self) -> str | Term:
+        token = self.peek()
+        if token is None:
+            raise QuerySyntaxError(f'unexpected end of {self.text!r}')
+        self.position += 1
+        return token
+
+    def parse(self) -> Query:
+        query = self.parse_query()
+        if self.peek() is not None:
+            raise QuerySyntaxError(
+                f'unexpected {self.peek()!r} in {self.text!r}'
+            )
+        for index, term in enumerate(query.get_terms()):
+            term.index = index
+        return query
+
+    def parse_query(self) -> Query:
+        operands = [self.parse_conjunction()]
+        while self.peek() == Operator.OR:
+            self.next()
+            operands.append(self.parse_conjunction())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def parse_conjunction(self) -> Query:
+        operands = [self.parse_negation()]
+        while self.peek() not in (None, Operator.OR, Operator.CLOSE):
+            if self.peek() == Operator.AND:
+                self.next()
+            operands.append(self.parse_negation())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def parse_negation(self) -> Query:
+        token = self.next()
+        if isinstance(token, Term):
+            return token
+        if token == Operator.NOT:
+            return Not(self.parse_negation())
+        if token == Operator.OPEN:
+            query = self.parse_query()
+            if self.next() != Operator.CLOSE:
+                raise QuerySyntaxError(f'unbalanced parentheses in '
+                                       f'{self.text!r}')
+            return query
+        raise QuerySyntaxError(f'unexpected {token!r} in {self.text!r}')
+
+
+def parse(text: str) -> Query:
+    # parse a query starting with the prefix
+    return Parser(text.lstrip().removeprefix(PREFIX)).parse()
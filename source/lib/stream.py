@@ -0,0 +1,82 @@
+"""
+The result of a filter streamed by filter.py --stream for the nvim integration
+(see nvim.config), as JSON objects, each on a single line:
+    {"append": [[TEXT, LINK], ...]}   lines appended to the result
+    {"heading": [[TEXT, LINK], ...]}  lines inserted at the top of the result
+    {"done": BASENAME}                the result is complete and saved in
+                                      the cache as BASENAME
+    {"error": MESSAGE}                the filter failed, filter.py prints
+                                      the error to stderr instead
+where LINK is [LINE, COLUMN, FILE], the line of the timeline the line of
+the result is linked to, as in the syncfile (see sync.py), or null. The heading
+is only known when the whole timeline has been filtered, so it is sent last.
+The messages are printed by filter.py --stream, or sent over the socket of
+timelined in response to a filter request with "stream": true (see
+timelined.py), which nvim can connect to without starting a process.
+"""
+import json
+from itertools import chain, repeat
+from pathlib import Path
+from typing import Any, TextIO
+
+from sync import Layout, open_sync
+
+
+class Stream:
+    # the number of lines sent at once
+    BATCH = 256
+
+    def __init__(self, file: TextIO, main_file: Path,
+                 layout: Layout | None = None) -> None:
+        self.file = file
+        self.main_file = str(main_file)
+        self.layout = layout
+        # the lines that haven't been sent yet
+        self.lines: list[list[Any]] = []
+
+    def get_links(self, linenumbers: range, column: int) -> list[list[Any]]:
+        file = self.main_file
+        if self.layout is not None:
+            index, linenumbers = self.layout.locate(linenumbers)
+            file = str(self.layout.files[index])
+        return [[linenumber, column, file] for linenumber in linenumbers]
+
+    def add(self, text: str, linenumbers: range | None = None,
+            column: int = 0) -> None:
+        # the lines of the printed text, linked to the linenumbers
+        lines = text.split('\n')
+        links = [None] * len(lines) if linenumbers is None \
+            else self.get_links(linenumbers, column)
+        self.lines += map(list, zip(lines, links))
+        if len(self.lines) >= self.BATCH:
+            self.flush()
+
+    def send(self, message: dict[str, Any]) -> None:
+        print(json.dumps(message), file=self.file, flush=True)
+
+    def flush(self, key: str = 'append') -> None:
+        if self.lines:
+            self.send({key: self.lines})
+            self.lines = []
+
+    def send_heading(self, heading: list[tuple[str, range | None]]) -> None:
+        # the heading is sent at once, so that it keeps its order when it is
+        # inserted at the top
+        self.flush()
+        self.send({'heading': [
+            [text, None if linenumbers is None
+             else self.get_links(linenumbers, 0)[0]]
+            for text, linenumbers in heading
+        ]})
+
+    def send_result(self, basename: str) -> None:
+        # stream a result that has already been saved, together with its
+        # heading
+        links = open_sync(Path(f'{basename}.sync')).get_links()
+        with open(f'{basename}.tln') as file_in:
+            for text, link in zip(file_in, chain(links, repeat(None))):
+                self.lines.append([text.rstrip('\n'),
+                                   link and list(link)])
+                if len(self.lines) >= self.BATCH:
+                    self.flush()
+        self.flush()
@@ -0,0 +1,310 @@
+"""
+The syncfile links the lines of a filter result to the lines of the timeline it
+was filtered from. It is saved next to the result with the suffix .sync and
+besides the links, it contains the id of the kitty window the filter was
+called from and the path of the timeline. It has one of two formats, chosen by
+the configuration key SyncFormat or by filter.py --sync-format:
+- text: the window id on the first line, the path on the second one, then
+  the linked line of the timeline on the line of the same number as the line of
+  the result, an empty line where there is no link,
+- binary: a fixed-size header with the window id and the length of the paths,
+  the paths separated by null bytes, then a fixed-width record of the linked
+  line, column and file for every line of the result, 0 where there is no
+  link. A link is found by seeking directly to its record.
+
+The format of an existing syncfile is recognized by its first bytes.
+
+If the timeline is a corpus of several files (see corpus.py), the linenumbers
+of the filtered elements are those of the files laid out one after another by
+Layout, which maps them back to the files. The text format then follows each
+linked line by the path of its file, the binary format lists all the files in
+the header and refers to them by their index.
+"""
+import os
+import struct
+from abc import ABC, abstractmethod
+from bisect import bisect
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+
+
+@dataclass
+class Layout:
+    """
+    The sections of the files of a corpus laid out one after another, in
+    a single space of linenumbers starting at 1.
+    """
+    # the main file first
+    files: list[Path]
+    # the first linenumber of each section in the layout, ascending
+    starts: list[int] = field(default_factory=list)
+    # the index of the file of each section and the difference between
+    # the linenumbers in the file and in the layout
+    sections: list[tuple[int, int]] = field(default_factory=list)
+
+    def add(self, start: int, file: int, shift: int) -> None:
+        self.starts.append(start)
+        self.sections.append((file, shift))
+
+    def locate(self, linenumbers: range) -> tuple[int, range]:
+        # the file and the linenumbers in it of consecutive linenumbers of
+        # the layout, all in the same section
+        file, shift = self.sections[bisect(self.starts, linenumbers.start) - 1]
+        return file, range(linenumbers.start + shift, linenumbers.stop + shift)
+
+
+class SyncFormat(ABC):
+    # 'b' if the syncfile is a binary file, '' otherwise
+    MODE: str
+
+    def __init__(self, layout: Layout | None = None) -> None:
+        # the layout of the corpus the linenumbers are in, None for a single
+        # file
+        self.layout = layout
+
+    @abstractmethod
+    def header(self, parent_id: int | None, main_file: Path) -> str | bytes:
+        # the beginning of the syncfile, aligned with the two lines of
+        # the heading of the result
+        raise NotImplementedError
+
+    @abstractmethod
+    def link(self, linenumbers: range, column: int = 0) -> str | bytes:
+        # the links of consecutive lines of the result to the lines
+        # 'linenumbers' of the timeline. If the column is 0, the cursor keeps
+        # its column.
+        raise NotImplementedError
+
+    @abstractmethod
+    def unlinked(self) -> str | bytes:
+        # a line of the result without a link
+        raise NotImplementedError
+
+
+class TextFormat(SyncFormat):
+    MODE = ''
+
+    def header(self, parent_id: int | None, main_file: Path) -> str:
+        return f'{parent_id if parent_id is not None else ""}\n{main_file}\n'
+
+    def link(self, linenumbers: range, column: int = 0) -> str:
+        # the text format has no columns
+        if self.layout is None:
+            return '\n'.join(map(str, linenumbers)) + '\n'
+        file, linenumbers = self.layout.locate(linenumbers)
+        path = self.layout.files[file]
+        return ''.join(f'{linenumber} {path}\n' for linenumber in linenumbers)
+
+    def unlinked(self) -> str:
+        return '\n'
+
+
+class BinaryFormat(SyncFormat):
+    MODE = 'b'
+    # the last byte of the magic is the version of the format
+    MAGIC = b'TLNSYNC\x02'
+    # magic, parent window id (-1 if none), length of the paths in bytes
+    HEADER = struct.Struct('<8sqI')
+    # line, column, index of the file
+    RECORD = struct.Struct('<III')
+    UNLINKED = RECORD.pack(0, 0, 0)
+
+    def header(self, parent_id: int | None, main_file: Path) -> bytes:
+        paths = b'\0'.join(map(os.fsencode, (
+            [main_file] if self.layout is None else self.layout.files
+        )))
+        return (self.HEADER.pack(self.MAGIC, -1 if parent_id is None
+                                 else parent_id, len(paths))
+                + paths + 2 * self.UNLINKED)
+
+    def link(self, linenumbers: range, column: int = 0) -> bytes:
+        file = 0
+        if self.layout is not None:
+            file, linenumbers = self.layout.locate(linenumbers)
+        if len(linenumbers) == 1:
+            return self.RECORD.pack(linenumbers[0], column, file)
+        return b''.join(self.RECORD.pack(linenumber, column, file)
+                        for linenumber in linenumbers)
+
+    def unlinked(self) -> bytes:
+        return self.UNLINKED
+
+
+SYNC_FORMATS: dict[str, type[SyncFormat]] = {
+    'text': TextFormat,
+    'binary': BinaryFormat,
+}
+
+
+class SyncFile(ABC):
+    """An existing syncfile, opened by open_sync()."""
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.parent_id: int | None = None
+        self.main_file = ''
+
+    @abstractmethod
+    def get_link(self, line: int) -> tuple[int, int, str | None] | None:
+        # the line and the column of the timeline linked to the line of
+        # the result and the file of the corpus it is in (None if the result
+        # is filtered from a single file), None if there is no link
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_links(self) -> Iterator[tuple[int, int, str] | None]:
+        # the links of all the lines of the result, in order, with the file
+        # always given
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_lines(self, linenumber: int, file: str | None = None) -> list[int]:
+        # the lines of the result linked to the line of the file of
+        # the corpus, by default of the main file
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_parent_id(self, parent_id: int | None) -> None:
+        raise NotImplementedError
+
+
+class TextSyncFile(SyncFile):
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        with open(path) as file_in:
+            parent_id = file_in.readline().strip()
+            self.main_file = file_in.readline().strip()
+        self.parent_id = int(parent_id) if parent_id else None
+
+    def get_link(self, line: int) -> tuple[int, int, str | None] | None:
+        if line <= 2:
+            # the heading
+            return None
+        with open(self.path) as file_in:
+            try:
+                linenumber, _, path = next(
+                    islice(file_in, line - 1, None)
+                ).strip().partition(' ')
+                linenumber = int(linenumber)
+            except (StopIteration, ValueError):
+                return None
+        return (linenumber, 0, path or None) if linenumber else None
+
+    def get_links(self) -> Iterator[tuple[int, int, str] | None]:
+        with open(self.path) as file_in:
+            for line, link in enumerate(file_in, 1):
+                linenumber, _, path = link.strip().partition(' ')
+                if line <= 2 or not linenumber.isdigit() \
+                        or not int(linenumber):
+                    yield None
+                else:
+                    yield int(linenumber), 0, path or self.main_file
+
+    def get_lines(self, linenumber: int, file: str | None = None) -> list[int]:
+        file = file or self.main_file
+        lines = []
+        with open(self.path) as file_in:
+            for line, link in enumerate(file_in, 1):
+                link, _, path = link.strip().partition(' ')
+                if (line > 2 and link == str(linenumber)
+                        and (path or self.main_file) == file):
+                    lines.append(line)
+        return lines
+
+    def set_parent_id(self, parent_id: int | None) -> None:
+        first, _, rest = self.path.read_text().partition('\n')
+        if first == (str(parent_id) if parent_id is not None else ''):
+            return
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(
+            f'{parent_id if parent_id is not None else ""}\n{rest}'
+        )
+        # atomically replace, so that nvim never sees a partial syncfile
+        os.replace(tmp_path, self.path)
+        self.parent_id = parent_id
+
+
+class BinarySyncFile(SyncFile):
+    HEADER = BinaryFormat.HEADER
+    # the records by the magic of each version, the first version only
+    # supported a single file and had no file in its records
+    RECORDS = {
+        b'TLNSYNC\x01': struct.Struct('<II'),
+        BinaryFormat.MAGIC: BinaryFormat.RECORD,
+    }
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        with open(path, 'rb') as file_in:
+            try:
+                magic, parent_id, length = self.HEADER.unpack(
+                    file_in.read(self.HEADER.size)
+                )
+            except struct.error:
+                raise ValueError(f'{path}: truncated header') from None
+            self.files = list(map(os.fsdecode,
+                                  file_in.read(length).split(b'\0')))
+        self.main_file = self.files[0]
+        self.parent_id = None if parent_id == -1 else parent_id
+        self.record = self.RECORDS[magic]
+        # the position of the record of the first line
+        self.records = self.HEADER.size + length
+
+    @staticmethod
+    def normalize(record: tuple) -> tuple[int, int, int]:
+        # the records of the first version refer to the only file
+        return record if len(record) == 3 else (*record, 0)
+
+    def get_link(self, line: int) -> tuple[int, int, str | None] | None:
+        if line < 1:
+            return None
+        with open(self.path, 'rb') as file_in:
+            file_in.seek(self.records + (line - 1) * self.record.size)
+            record = file_in.read(self.record.size)
+        if len(record) < self.record.size:
+            return None
+        linenumber, column, file = self.normalize(self.record.unpack(record))
+        if not linenumber:
+            return None
+        return (linenumber, column,
+                self.files[file] if len(self.files) > 1 else None)
+
+    def get_links(self) -> Iterator[tuple[int, int, str] | None]:
+        with open(self.path, 'rb') as file_in:
+            file_in.seek(self.records)
+            data = file_in.read()
+        for linenumber, column, file in map(self.normalize,
+                                            self.record.iter_unpack(data)):
+            yield (linenumber, column, self.files[file]) if linenumber \
+                else None
+
+    def get_lines(self, linenumber: int, file: str | None = None) -> list[int]:
+        try:
+            index = self.files.index(file) if file else 0
+        except ValueError:
+            return []
+        with open(self.path, 'rb') as file_in:
+            file_in.seek(self.records)
+            data = file_in.read()
+        return [line for line, record in enumerate(
+            map(self.normalize, self.record.iter_unpack(data)), 1
+        ) if record[0] == linenumber and record[2] == index]
+
+    def set_parent_id(self, parent_id: int | None) -> None:
+        # the id has a fixed width, overwrite it in place
+        with open(self.path, 'r+b') as file_out:
+            file_out.seek(len(BinaryFormat.MAGIC))
+            file_out.write(struct.pack('<q', -1 if parent_id is None
+                                       else parent_id))
+        self.parent_id = parent_id
+
+
+def open_sync(path: Path) -> SyncFile:
+    # the syncfile in either format, raises OSError if it cannot be read and
+    # ValueError if it is corrupted
+    with open(path, 'rb') as file_in:
+        magic = file_in.read(len(BinaryFormat.MAGIC))
+    if magic in BinarySyncFile.RECORDS:
+        return BinarySyncFile(path)
+    return TextSyncFile(path)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+import argparse
+import io
+import json
+import locale
+import os
+import pickle
+import select
+import signal
+import socket
+import socketserver
+import sys
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any, TextIO
+
+from traverser import Traverser, Element, Dated
+from cache import CheckpointIndex
+from config import config, Config, ConfigError
+from filter import filter_file, prune_cache
+from list import get_output
+from matcher import LiveSearch
+import daemon
+
+
+class Model(CheckpointIndex):
+    """
+    Timeline file parsed into elements kept in memory. When the file changes,
+    the elements are kept up to the last checkpoint above the first change
+    and only the rest of the file is parsed again. The checkpoints are kept
+    in memory, too.
+    """
+    def __init__(self, path: Path, verbose: bool = False) -> None:
+        super().__init__(path)
+        # log the reloads to stderr
+        self.verbose = verbose
+        # size and mtime of the file the elements were parsed from
+        self.header: dict[str, int] | None = None
+        # elements as loaded by ParseCache, i.e. not bound to any date
+        self.elements: list[Element] = []
+        # pickled elements, to make fresh copies for the filters, which modify
+        # the elements
+        self.pickled = b''
+        # elements parsed during the last reload
+        self.parsed: list[Element] = []
+
+    def read(self) -> Iterator[Any]:
+        if self.header is not None:
+            yield self.header
+            yield self.checkpoints
+
+    def write(self, header: dict[str, int],
+              checkpoints: list[Any]) -> None:
+        self.header = header
+
+    def save(self, traverser: Traverser, elements: Iterator[Element],
+             data: bytes) -> Iterator[Element]:
+        for element in super().save(traverser, elements, data):
+            self.parsed.append(element)
+            yield element
+
+    def is_current(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return self.header == {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+
+    def reload(self) -> None:
+        if self.is_current():
+            return
+        self.parsed = []
+        resumed = self.traverse(Traverser())
+        # keep the elements up to the line the traversal resumed after,
+        # parse_lines has yielded all of them before that line
+        keep = next((
+            index + 1 for index in range(len(self.elements) - 1, -1, -1)
+            if self.elements[index].linenumber == resumed
+            and isinstance(self.elements[index], self.RESUMABLE)
+        ), 0) if resumed else 0
+        # the dates are bound by the replaying Traverser
+        for element in self.parsed:
+            if isinstance(element, Dated):
+                element.date = None
+        if self.verbose:
+            print(f'{self.path}: reparsed from line {resumed + 1}, '
+                  f'{len(self.parsed)} elements', file=sys.stderr)
+        self.elements = self.elements[:keep] + self.parsed
+        self.parsed = []
+        self.pickled = pickle.dumps(self.elements, pickle.HIGHEST_PROTOCOL)
+
+    def get_copy(self) -> list[Element]:
+        self.reload()
+        return pickle.loads(self.pickled)
+
+    def traverse_to(self, max_lines: int) -> Traverser:
+        # the Traverser after traversing the file until the line max_lines
+        self.reload()
+        traverser = Traverser()
+        traverser.traverse_elements(traverser.replay(self.elements, max_lines))
+        return traverser
+
+
+class Handler(socketserver.StreamRequestHandler):
+    server: 'Server'
+
+    def handle(self) -> None:
+        # one request per connection, a JSON object on a single line. It is
+        # answered by a single response, which is preceded by the streamed
+        # result if a filter is requested with 'stream', see stream.py.
+        line = self.rfile.readline()
+        out = io.TextIOWrapper(self.wfile, encoding='utf-8',
+                               write_through=True)
+        try:
+            response = self.server.respond(json.loads(line), out,
+                                           self.is_stale)
+        except Exception as e:
+            response = {'error': f'{type(e).__name__}: {e}'}
+        try:
+            print(json.dumps(response), file=out, flush=True)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client has gone away, e.g. nvim has stopped a streamed
+            # filter to start another one
+            pass
+        # leave closing the socket to the server
+        out.detach()
+
+    def is_stale(self) -> bool:
+        # The client has gone away or another request is waiting, e.g. for
+        # the next term of a live search. The client sends nothing more after
+        # the request, so its socket only becomes readable when it is closed.
+        readable, _, _ = select.select([self.server.socket, self.connection],
+                                       [], [], 0)
+        return bool(readable)
+
+
+class Server(socketserver.UnixStreamServer):
+    def __init__(self, path: Path, verbose: bool = False) -> None:
+        super().__init__(str(path), Handler)
+        # log the requests and the reloads of the models to stderr
+        self.verbose = verbose
+        self.models: dict[Path, Model] = {}
+        # the scores of the live searches by the file and the matcher
+        self.live: dict[tuple[Path, str], LiveSearch] = {}
+        # set on SIGHUP, the configuration is read again before the next
+        # request
+        self.reload_config = False
+
+    def get_model(self, file: str) -> Model:
+        path = Path(file).resolve()
+        if path not in self.models:
+            self.models[path] = Model(path, self.verbose)
+        return self.models[path]
+
+    def get_copies(self, files: list[Path]) -> list[list[Element]]:
+        # the elements of the files of a corpus, see corpus.py
+        return [self.get_model(str(path)).get_copy() for path in files]
+
+    @staticmethod
+    def has_config(directory: str) -> bool:
+        # whether a client in the directory reads the same configuration
+        try:
+            return Config(Path(directory)).get_snapshot() \
+                == config.get_snapshot()
+        except ConfigError:
+            return False
+
+    def respond(self, request: dict[str, Any], out: TextIO,
+                stale: Callable[[], bool]) -> dict[str, Any]:
+        # the requests are handled one at a time, so the models don't need any
+        # locking
+        if self.verbose:
+            print(request, file=sys.stderr)
+        if self.reload_config:
+            self.reload_config = False
+            config.reload()
+            locale.setlocale(locale.LC_TIME, config.Locale)
+            # the elements and the scores depend on the configuration, too
+            self.models.clear()
+            self.live.clear()
+        if 'cwd' in request and not self.has_config(request['cwd']):
+            return {'fallback': f'the configuration differs in '
+                                f'{request["cwd"]}'}
+        model = self.get_model(request['file'])
+        match request['command']:
+            case 'filter':
+                stream = request.get('stream', False)
+                live = None
+                if request.get('live', False):
+                    # the term is being typed, score it from the previous one
+                    live = self.live.setdefault(
+                        (model.path, request['matcher'] or config.Matcher),
+                        LiveSearch()
+                    )
+                basename = filter_file(
+                    model.path, request['find'], request['parent_id'],
+                    self.get_copies, request['batch'] or live is not None,
+                    request['workers'], request['matcher'],
+                    request['sync_format'], request['parallel'],
+                    out if stream else None, live, stale,
+                    request.get('top')
+                )
+                if stream:
+                    # the result goes to nvim directly, not through filter.py,
+                    # which would prune the cache otherwise
+                    prune_cache(basename)
+                    return {'done': basename}
+                return {'basename': basename}
+            case 'list':
+                return {'output': get_output(
+                    model.traverse_to(request['line']),
+                    request['generate_date']
+                )}
+            case command:
+                raise ValueError(f'unknown command {command!r}')
+
+
+def main():
+    # the daemon handles the requests with its own configuration, read in
+    # the directory it was started in
+    locale.setlocale(locale.LC_TIME, config.Locale)
+
+    parser = argparse.ArgumentParser(
+        description='Keep the parsed timelines in memory and serve filter.py '
+                    'and list.py over a Unix socket.'
+    )
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request and every reparsed file to '
+                             'stderr')
+    args = parser.parse_args()
+
+    path = daemon.get_socket_path()
+    # remove a stale socket, unless another daemon is listening on it
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            path.unlink(missing_ok=True)
+        else:
+            parser.exit(1, f'timelined is already listening on {path}\n')
+    with Server(path, args.verbose) as server:
+        signal.signal(signal.SIGHUP,
+                      lambda signum, frame: setattr(server, 'reload_config',
+                                                    True))
+        print(f'listening on {path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
+import codecs
+import io
+import locale
+import mmap
+import os
 import re
 import sys
+from array import array
 from abc import abstractmethod, ABC
-from collections.abc import Iterator
+from functools import cache
+from collections.abc import Callable, Iterator, Sequence
 from math import inf
 from typing import Iterable, TypeAlias, Protocol, runtime_checkable
 from itertools import repeat, chain
+from pathlib import Path
 import datetime
 
 from config import config
@@ -33,6 +41,7 @@ class ExtendedInt(float):
     only linear order, the ring and metric structure should be considered
     to be undefined.
     """
+    __slots__ = ()
     _convert_store = {
             '': 0,
             '?': 0,
@@ -48,6 +57,9 @@ class ExtendedInt(float):
         -inf: '-∞',
         0: '?',
     }
+    # the instances are immutable, so they are shared by the values they were
+    # constructed from
+    _instances: dict['DateElement', 'ExtendedInt'] = {}
 
     def __new__(cls, value):
         """
@@ -59,11 +71,23 @@ class ExtendedInt(float):
         If the value is a string, it is stripped of leading and trailing
         whitespace before conversion.
         """
+        if type(value) is ExtendedInt:
+            return value
+        if value in cls._instances:
+            return cls._instances[value]
+        key = value
         if isinstance(value, str):
             value = value.strip()
-        value = (cls._convert_store[value] if value in cls._convert_store 
-                 else int(value))
-        return float.__new__(ExtendedInt, value)
+        # the infinities are floats, and so are the values they are unpickled
+        # from by older caches
+        value = (cls._convert_store[value] if value in cls._convert_store
+                 else value if value in (inf, -inf) else int(value))
+        instance = cls._instances[key] = float.__new__(ExtendedInt, value)
+        return instance
+
+    def __getnewargs__(self):
+        # pickle the value as it is printed, which __new__ accepts
+        return repr(self),
 
     def __index__(self):
         # needed for passing ExtendedInt instances into datetime.date()
@@ -105,6 +129,12 @@ class Syntax:
 
 
 class Element(ABC):
+    # The elements are the bulk of the memory of a parsed timeline, so they
+    # don't have __dict__.
+    __slots__ = ('linenumber',)
+    # the column of the linked line of the timeline, see sync.py
+    SYNC_COLUMN = 0
+
     def __init__(self, linenumber: int):
         self.linenumber = linenumber
 
@@ -115,11 +145,22 @@ class Element(ABC):
     def get_sync(self) -> str:
         return str(self.linenumber)
 
+    def get_sync_range(self) -> range:
+        # the lines of the timeline the printed lines of the element are linked
+        # to
+        return range(self.linenumber, self.linenumber + 1)
+
+    def move(self, offset: int) -> None:
+        # move the element by offset lines, see corpus.py
+        self.linenumber += offset
+
     def get_indent(self) -> int:
         return 0
 
 
 class Command(Element):
+    __slots__ = ()
+
     def __str__(self) -> str:
         return ''
 
@@ -128,6 +169,8 @@ class Command(Element):
         match line.split():
             case ['reset']:
                 return Reset(linenumber)
+            case ['include', _, *_]:
+                return Include(linenumber, line.split(maxsplit=1)[1].rstrip())
             case _:
                 raise UnknownCommandError(line, "Unknown command")
 
@@ -147,6 +190,8 @@ class Reset(Command):
     #   skipped. Implement the ordering, this will enable us to retain the
     #   chronologicity test and 'accidentally' fixes the FIXME_ in list.py. That
     #   is a sign of a good implementation :)
+    __slots__ = ()
+
     def __init__(self, linenumber: int):
         super().__init__(linenumber)
 
@@ -154,7 +199,23 @@ class Reset(Command):
         traverser.date = Date(self.linenumber)
 
 
+class Include(Command):
+    # Include the timeline in the file at path, relative to the directory of
+    # this file, see corpus.py. Only used to find the files of the corpus,
+    # the traversal of this file ignores it.
+    __slots__ = ('path',)
+
+    def __init__(self, linenumber: int, path: str):
+        super().__init__(linenumber)
+        self.path = path
+
+    def apply(self, traverser: 'Traverser') -> None:
+        pass
+
+
 class Empty(Element):
+    __slots__ = ('line',)
+
     def __init__(self, linenumber: int, line: str):
         super().__init__(linenumber)
         self.line = line
@@ -164,6 +225,8 @@ class Empty(Element):
 
 
 class Ellipse(Empty):
+    __slots__ = ()
+
     def __init__(self, linenumber: int, line: str = Syntax.ELLIPSE):
         super().__init__(linenumber, line)
 
@@ -172,12 +235,37 @@ class Ellipse(Empty):
 
 
 class Spaced(Element):
+    __slots__ = ('empty_line',)
+
     def __init__(self, linenumber: int, empty_line: Empty | None):
         super().__init__(linenumber)
         self.empty_line = empty_line
 
 
+@cache
+def get_weekday_names(locale_name: str) -> tuple[str, ...]:
+    # the names of the days of the week in the LC_TIME locale, Monday first
+    monday = datetime.date(2024, 1, 1)
+    return tuple((monday + datetime.timedelta(days)).strftime('%A')
+                 for days in range(7))
+
+
+def get_weekday_name(date: datetime.date) -> str:
+    return get_weekday_names(locale.setlocale(locale.LC_TIME))[date.weekday()]
+
+
 class Date(Spaced):
+    # The numbers packed into a single integer, year first, each in FIELD_BITS
+    # bits. Undefined numbers are 0, ∞ is FIELD_MAX. The mask has ones in
+    # the bits of the defined numbers, see __gt__().
+    FIELD_BITS = 32
+    FIELD_MAX = (1 << FIELD_BITS) - 1
+    # the printed date isn't the text of the line it is linked to, jump to
+    # the beginning of the line
+    SYNC_COLUMN = 1
+    __slots__ = ('day', 'month', 'year', 'indent', 'day_of_week', 'key',
+                 'mask', 'text')
+
     def __init__(
             self, linenumber: int = 0, empty_line: Empty | None = None,
             day: DateElement = 0, month: DateElement = 0, year: DateElement = 0,
@@ -192,13 +280,32 @@ class Date(Spaced):
             raise LineParsingError(linenumber, e)
         self.indent = indent
         self.day_of_week: str | None = None
+        self.key: int | None = 0
+        self.mask = 0
+        for number in (self.year, self.month, self.day):
+            self.key <<= self.FIELD_BITS
+            self.mask <<= self.FIELD_BITS
+            if number == 0:
+                continue
+            if number == inf:
+                field = self.FIELD_MAX
+            elif 1 <= number < self.FIELD_MAX:
+                field = int(number)
+            else:
+                # negative or too large, compare the numbers one by one
+                self.key = None
+                break
+            self.key |= field
+            self.mask |= self.FIELD_MAX
+        # the date without the indent and the day of the week
+        self.text: str | None = None
 
     def get_day_of_week(self) -> str:
         if self.day_of_week is None:
             date = (self.year, self.month, self.day)
             if all(date):
-                self.day_of_week = (f' {Syntax.COMMENT}'
-                                    f' {datetime.date(*date).strftime("%A")}')
+                weekday = get_weekday_name(datetime.date(*date))
+                self.day_of_week = f' {Syntax.COMMENT} {weekday}'
             else:
                 self.day_of_week = ''
         return self.day_of_week
@@ -206,6 +313,9 @@ class Date(Spaced):
     def __gt__(self, other):
         if not isinstance(other, Date):
             return NotImplemented
+        if self.key is not None and other.key is not None:
+            # the undefined numbers of self are skipped
+            return self.key > other.key & self.mask
         # 14.3. › 3.3.
         # ?.?.2000 > ?.?.1999
         # ?.?.2000 > 31.12.?
@@ -222,17 +332,17 @@ class Date(Spaced):
         return False
 
     def __str__(self):
-        return ''.join(map(str, (
-            ' ' * self.indent,
-            Syntax.DATE,
-            ' ',
-            self.day,
-            Syntax.DATE_DELIMITER,
-            self.month,
-            Syntax.DATE_DELIMITER,
-            self.year,
-            self.get_day_of_week(),
-        )))
+        if self.text is None:
+            self.text = ''.join(map(str, (
+                Syntax.DATE,
+                ' ',
+                self.day,
+                Syntax.DATE_DELIMITER,
+                self.month,
+                Syntax.DATE_DELIMITER,
+                self.year,
+            )))
+        return ' ' * self.indent + self.text + self.get_day_of_week()
 
     def update(self, other: 'Date', keep_empty_line: bool = False) -> 'Date':
         """Return 'union' of dates, where 'other' is taking precedence"""
@@ -254,7 +364,8 @@ class Date(Spaced):
         if all(date):
             tomorrow = datetime.date(*date) + datetime.timedelta(1)
             out = Date(0, None, tomorrow.day, tomorrow.month, tomorrow.year)
-            out.day_of_week = f' {Syntax.COMMENT} ' + tomorrow.strftime('%A')
+            out.day_of_week = (f' {Syntax.COMMENT} '
+                               + get_weekday_name(tomorrow))
             return out
         out = Date().update(self)
         out.day_of_week = f' {Syntax.COMMENT} UNABLE TO INCREMENT'
@@ -275,6 +386,8 @@ class Date(Spaced):
 
 
 class Dated(Spaced):
+    __slots__ = ('date', 'line')
+
     def __init__(self, linenumber: int, empty_line: Empty | None, date: Date,
                  line: str):
         super().__init__(linenumber, empty_line)
@@ -289,10 +402,12 @@ class Dated(Spaced):
 
 
 class Description(Dated):
+    __slots__ = ('name', 'descriptions')
+
     def __init__(self, linenumber: int, empty_line: Empty | None, date: Date,
                  line: str, name: str, descriptions: Iterable[str]):
         super().__init__(linenumber, empty_line, date, line)
-        self.name = name
+        self.name = sys.intern(name)
         self.descriptions = tuple(descriptions)
 
     def __repr__(self):
@@ -302,14 +417,19 @@ class Description(Dated):
 
 
 class Block(Dated):
+    __slots__ = ('type', 'name')
+
     def __init__(self, linenumber: int, empty_line: Empty | None, date: Date,
                  line: str, type: str, name: str):
         super().__init__(linenumber, empty_line, date, line)
-        self.type = type
-        self.name = name
+        # there are only a few distinct types and names, share them
+        self.type = sys.intern(type)
+        self.name = sys.intern(name)
 
 
 class Enter(Block):
+    __slots__ = ('descriptions', 'printed', 'waiting', 'waited_by')
+
     def __init__(self, linenumber: int, empty_line: Empty | None, date: Date,
                  line: str, type: str, name: str, descriptions: Iterable[str], ):
         super().__init__(linenumber, empty_line, date, line, type, name)
@@ -336,6 +456,8 @@ class Enter(Block):
 
 
 class Leave(Block):
+    __slots__ = ('linenumber_enter', 'waiting_for')
+
     def __init__(self, linenumber: int, empty_line: Empty | None, date: Date,
                  line: str, type: str, name: str):
         super().__init__(linenumber, empty_line, date, line, type, name)
@@ -352,34 +474,199 @@ class Leave(Block):
 
 
 class Note(Dated):
+    # _text is either the text, a MappedLine spanning all its lines, or the
+    # list of its lines if they are not adjacent in the mapped file. The
+    # MappedLine are decoded only when the text is needed.
+    __slots__ = ('_last_linenumber', '_text')
+
     def __init__(self, linenumber: int, empty_line: Empty | None, date: Date,
-                 line: str):
+                 line: 'str | MappedLine'):
         super().__init__(linenumber, empty_line, date, line)
-        self.searchable: str = line
         self._last_linenumber: int = linenumber
-        self._sync: str = str(linenumber)
 
-    def add_line(self, line: str) -> None:
-        self.line += '\n' + line
-        self.searchable += ' ' + line
+    @property
+    def line(self) -> str:
+        if isinstance(self._text, list):
+            return '\n'.join(map(str, self._text))
+        return str(self._text)
+
+    @line.setter
+    def line(self, line: 'str | MappedLine') -> None:
+        self._text = line
+
+    def add_line(self, line: 'str | MappedLine') -> None:
+        if isinstance(self._text, str) and isinstance(line, str):
+            self._text += '\n' + line
+        elif (isinstance(self._text, MappedLine)
+              and isinstance(line, MappedLine) and self._text.precedes(line)):
+            self._text.end = line.end
+        else:
+            if not isinstance(self._text, list):
+                self._text = [self._text]
+            self._text.append(line)
         self._last_linenumber += 1
-        self._sync += '\n' + str(self._last_linenumber)
+
+    def __getstate__(self):
+        # the mapped file cannot be pickled, decode the text
+        self._text = self.line
+        return super().__getstate__()
+
+    @property
+    def searchable(self) -> str:
+        # the lines joined into a single line, computed when searched to avoid
+        # storing the text twice
+        return self.line.replace('\n', ' ')
 
     def get_sync(self) -> str:
-        return self._sync
+        return '\n'.join(map(str, self.get_sync_range()))
+
+    def get_sync_range(self) -> range:
+        return range(self.linenumber, self._last_linenumber + 1)
+
+    def move(self, offset: int) -> None:
+        super().move(offset)
+        self._last_linenumber += offset
 
     def __repr__(self) -> str:
         return ''.join(chain(*zip(
-            self._sync.split('\n'), repeat('|'),
+            self.get_sync().split('\n'), repeat('|'),
             self.line.split('\n'), repeat('\n')
         )))[:-1]
 
 
 class Item(Note):
-    pass
+    __slots__ = ()
+
+
+class MappedLine:
+    """
+    A line of a note in a MappedLines file, decoded whenever it is converted to
+    str.
+    """
+    __slots__ = ('buffer', 'start', 'end')
+
+    def __init__(self, buffer: mmap.mmap, start: int, end: int) -> None:
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def __str__(self) -> str:
+        return self.buffer[self.start:self.end].decode()
+
+    def precedes(self, line: 'MappedLine') -> bool:
+        # whether the line follows right after this one, separated only by \n
+        return self.end + 1 == line.start and self.buffer[self.end] == 0x0a
+
+
+class MappedLines:
+    """
+    Memory-mapped timeline file to be passed to Traverser.parse_lines instead of
+    a text file. Lines of notes are classified in the raw buffer and yielded
+    as MappedLine without being decoded, the other lines are yielded as str.
+    Only UTF-8 files with LF or CRLF line endings are classified this way,
+    the lines of other files are all decoded the same way as by open().
+    """
+    # characters beginning the lines that are not plain notes
+    SPECIAL = frozenset(
+        (Syntax.COMMAND + Syntax.DATE + Syntax.ENTER + Syntax.LEAVE
+         + Syntax.DESCRIPTION + Syntax.ITEM + Syntax.ELLIPSE
+         + Syntax.COMMENT).encode()
+    )
+    # the ASCII whitespace stripped by str.strip()
+    WHITESPACE = frozenset(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')
+    LEADING = re.compile(rb'[ \t\r\x0b\x0c\x1c-\x1f]*')
+    # a carriage return that is a line ending by itself
+    CARRIAGE_RETURN = re.compile(rb'\r(?!\n)')
+
+    def __init__(self, path: str | Path, offset: int = 0) -> None:
+        with open(path, 'rb') as file_in:
+            size = os.fstat(file_in.fileno()).st_size
+            # an empty file cannot be mapped
+            self.buffer = mmap.mmap(file_in.fileno(), 0,
+                                    access=mmap.ACCESS_READ) if size else b''
+        # the position in the buffer of the line to be read next
+        self.offset = offset
+        # the positions of the lines read so far
+        self.offsets = array('q')
+        self.mapped = (
+            codecs.lookup(locale.getpreferredencoding(False)).name == 'utf-8'
+            and self.CARRIAGE_RETURN.search(self.buffer) is None
+        )
+
+    def __enter__(self) -> 'MappedLines':
+        return self
+
+    def __exit__(self, *args) -> None:
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __iter__(self) -> Iterator['str | MappedLine']:
+        if not self.mapped:
+            yield from self.decode_lines()
+            return
+        buffer = self.buffer
+        size = len(buffer)
+        while self.offset < size:
+            start = self.offset
+            end = buffer.find(b'\n', start)
+            if end == -1:
+                end = size
+            self.offset = end + 1
+            self.offsets.append(start)
+            yield self.classify(start, end)
+
+    def decode_lines(self) -> Iterator[str]:
+        file_in = io.TextIOWrapper(io.BytesIO(self.buffer[self.offset:]),
+                                   newline='')
+        for line in file_in:
+            self.offsets.append(self.offset)
+            self.offset += len(line.encode(file_in.encoding))
+            yield line
+
+    def classify(self, start: int, end: int) -> 'str | MappedLine':
+        # Return a MappedLine if the line is a line of a note, as parse_lines
+        # would process it, i.e. right-stripped and without the comment.
+        # Otherwise return the decoded line.
+        buffer = self.buffer
+        first = self.LEADING.match(buffer, start, end).end()
+        if first == end or buffer[first] in self.SPECIAL:
+            return buffer[start:end].decode()
+        stop = end
+        while buffer[stop - 1] in self.WHITESPACE:
+            stop -= 1
+        # str.strip() strips some non-ASCII whitespace as well
+        if (self.is_space(buffer[first:first + 4], first=True)
+                or self.is_space(buffer[max(first, stop - 4):stop],
+                                 first=False)):
+            return buffer[start:end].decode()
+        comment = buffer.find(Syntax.COMMENT.encode(), first, stop)
+        return MappedLine(buffer, start, stop if comment == -1 else comment)
+
+    @staticmethod
+    def is_space(data: bytes, first: bool) -> bool:
+        # whether the first or the last character of UTF-8 data is a non-ASCII
+        # whitespace
+        if (data[0] if first else data[-1]) < 0x80:
+            return False
+        character = data.decode(errors='ignore')
+        return bool(character) and (character[0] if first
+                                    else character[-1]).isspace()
+
+
+@cache
+def get_kind(element_type: type[Element]) -> type[Element]:
+    # isinstance() is slow for abstract classes, Traverser.replay() uses this
+    # to classify each type of elements only once
+    for kind in (Note, Dated, Command, Ellipse, Empty):
+        if issubclass(element_type, kind):
+            return kind
+    return Element
 
 
 class Traverser:
+    # names of Leaves without any special characters of regular expressions
+    LITERAL = re.compile(r'[^.^$*+?{}\[\]\\|()]*')
+
     def __init__(self) -> None:
         # Keys are linenumbers - in the future, when more enter/leave commands
         # on single line are supported, the keys may become tuples (linenumber,
@@ -388,6 +675,15 @@ class Traverser:
         # printed - then the 'printed' flag is set, preventing it to be printed
         # again and indicating that the leaving line has to be printed, too.
         self.blocks: dict[int, Block] = {}
+        # The open Enters that are not waiting, i.e. those a Leave can be
+        # matched to, in the same order as in self.blocks, and the same Enters
+        # grouped by type. Only updated when an Enter is traversed and when
+        # a Leave is matched to it, since then the Enter is either deleted
+        # from self.blocks or marked as waiting.
+        self.open_enters: dict[int, Enter] = {}
+        self.open_types: dict[str, dict[int, Enter]] = {}
+        # the functions matching the names of Enters, by the names of Leaves
+        self.leave_patterns: dict[str, Callable[[str], bool]] = {}
         # last encountered date
         self.date: Date = Date()
         # The following flag is reset each time an element other than
@@ -400,8 +696,35 @@ class Traverser:
         self.empty_line = None
         return out
 
+    def get_state(self) -> tuple:
+        # everything needed to resume the traversal on the next line, provided
+        # that parse_lines doesn't have any unfinished note
+        return self.blocks, self.date, self.empty_line, self.last_parsed
+
+    def set_state(self, state: tuple) -> None:
+        self.blocks, self.date, self.empty_line, self.last_parsed = state
+        self.open_enters = {}
+        self.open_types = {}
+        for block in self.blocks.values():
+            if isinstance(block, Enter) and not block.waiting:
+                self.add_open_enter(block)
+
+    def add_open_enter(self, enter: Enter) -> None:
+        self.open_enters[enter.linenumber] = enter
+        self.open_types.setdefault(enter.type, {})[enter.linenumber] = enter
+
+    def remove_open_enter(self, enter: Enter) -> None:
+        del self.open_enters[enter.linenumber]
+        same_type = self.open_types[enter.type]
+        del same_type[enter.linenumber]
+        if not same_type:
+            del self.open_types[enter.type]
+
     def traverse(self, file_in: Iterable[str], max_lines: int = -1) -> None:
-        for element in self.parse_lines(file_in, max_lines):
+        self.traverse_elements(self.parse_lines(file_in, max_lines))
+
+    def traverse_elements(self, elements: Iterable[Element]) -> None:
+        for element in elements:
             if isinstance(element, Empty):
                 self.empty_line = self.empty_line or element
                 # don't save Empty as last parsed element, we aren't interested
@@ -423,6 +746,7 @@ class Traverser:
             elif isinstance(element, Enter):
                 self.handle_enter(element)
                 self.blocks[element.linenumber] = element
+                self.add_open_enter(element)
             elif isinstance(element, Leave):
                 self.block_leave(element)
             elif isinstance(element, Description):
@@ -434,14 +758,24 @@ class Traverser:
                                        f'element {element} not recognized')
             self.last_parsed = element
 
-    def parse_lines(self, file_in: Iterable[str], max_lines: int)\
-            -> Iterator[Element]:
+    def parse_lines(self, file_in: Iterable['str | MappedLine'],
+                    max_lines: int,
+                    first_linenumber: int = 1) -> Iterator[Element]:
         note: Note | None = None
-        for linenumber, line in enumerate(file_in, 1):
+        for linenumber, line in enumerate(file_in, first_linenumber):
             if linenumber == max_lines:
                 # Traverse only lines above cursor, not including the line
                 # under cursor. This makes closing blocks easier.
                 break
+            if isinstance(line, MappedLine):
+                # MappedLines has already found out that this is a line of
+                # a note and processed it
+                if note:
+                    note.add_line(line)
+                else:
+                    note = Note(linenumber, self.get_empty_line(), self.date,
+                                line)
+                continue
             # strip the trailing newline and whitespace
             line = line.rstrip()
             # throw off comment
@@ -533,14 +867,54 @@ class Traverser:
             else:
                 note = Note(linenumber, self.get_empty_line(), self.date, line)
 
+    def replay(self, elements: Sequence[Element], max_lines: int = -1)\
+            -> Iterator[Element]:
+        """
+        Yield elements parsed by parse_lines of another Traverser (typically
+        loaded from ParseCache) as if they were parsed by this Traverser, i.e.
+        bind them to its date and keep its empty_line up to date. Elements that
+        parse_lines wouldn't yield before reaching the line max_lines are
+        omitted.
+        """
+        # linenumbers and dates before applying of the commands that have been
+        # replayed since the last other element
+        commands: list[tuple[int, Date]] = []
+        for index, element in enumerate(elements):
+            kind = get_kind(type(element))
+            if kind is Note:
+                # parse_lines yields a note only when it parses the next
+                # element, but commands don't end notes
+                following = index + 1
+                while (following < len(elements) and
+                       get_kind(type(elements[following])) is Command):
+                    following += 1
+                yielded_at = (elements[following].linenumber
+                              if following < len(elements) else sys.maxsize)
+            else:
+                yielded_at = element.linenumber
+            if 0 < max_lines <= yielded_at:
+                if element.linenumber < max_lines:
+                    # the unfinished note would already take the empty line
+                    self.empty_line = None
+                return
+            if kind is Command:
+                commands.append((element.linenumber, self.date))
+            elif kind is not Empty:
+                if kind is Note or kind is Dated:
+                    # the date when the first line of the element was parsed
+                    element.date = next((
+                        date for linenumber, date in commands
+                        if linenumber > element.linenumber
+                    ), self.date)
+                # the element took the empty line, or it is an ellipse
+                self.empty_line = None
+                commands.clear()
+            yield element
+
     def inside_list(self) -> bool:
-        for block in reversed(self.blocks.values()):
-            if isinstance(block, Enter) and self.block_match(
-                    block,
-                    Leave(sys.maxsize, None, self.date, Syntax.LEAVE, '', '')
-            ):
-                return block.type.startswith(Syntax.LIST_TYPE)
-        return False
+        # whether the last Enter an empty Leave would match is a list
+        enter = next(reversed(self.open_enters.values()), None)
+        return enter is not None and enter.type.startswith(Syntax.LIST_TYPE)
 
     def handle_date(self, date: Date) -> None:
         # update date
@@ -550,33 +924,58 @@ class Traverser:
         pass
 
     def block_leave(self, leave: Leave) -> None:
-        # Walk through self.blocks in reverse, searching for the first matching
-        # non-waiting Enter. If another non-waiting not printed Enter
-        # was encountered, save the Leave, mark the block as waiting and
-        # return None. In other case, remove the corresponding Enter and
-        # resolve eventual waiting blocks.
-        for block in reversed(self.blocks.values()):
-            if not isinstance(block, Enter):
-                continue
-            if self.block_match(block, leave):
-                self.handle_leave_matched(leave, block)
-                return
-            self.handle_leave_nonmatched(leave, block)
-        raise StructureError(leave.linenumber, leave.line,
-                             'No such block is open')
+        # Search the open Enters of the type of the Leave (or all, if it has no
+        # type) in reverse for the first matching non-waiting Enter. Then call
+        # handle_leave_nonmatched for each non-waiting Enter after it, which
+        # the Leave is interleaved with, and handle_leave_matched, which either
+        # removes the Enter from self.blocks or marks it as waiting.
+        candidates = (self.open_types.get(leave.type, {}) if leave.type
+                      else self.open_enters)
+        match = self.get_leave_pattern(leave.name)
+        enter = next((
+            enter for enter in reversed(candidates.values())
+            if match(enter.name)
+        ), None)
+        if enter is None:
+            raise StructureError(leave.linenumber, leave.line,
+                                 'No such block is open')
+        for interleaved in reversed(self.open_enters.values()):
+            if interleaved is enter:
+                break
+            self.handle_leave_nonmatched(leave, interleaved)
+        self.handle_leave_matched(leave, enter)
+        self.remove_open_enter(enter)
+
+    def get_leave_pattern(self, name: str) -> Callable[[str], bool]:
+        # Return a function telling whether the name of an Enter contains
+        # a substring matched by the regular expression 'name'. Literal names
+        # are searched for as substrings, case-insensitively only if both
+        # the names are ASCII, where str.lower() agrees with re.IGNORECASE.
+        if name in self.leave_patterns:
+            return self.leave_patterns[name]
+        pattern = re.compile(
+            name, re.NOFLAG if config.CaseSensitiveLeave else re.IGNORECASE
+        )
 
-    @staticmethod
-    def block_match(enter: Enter, leave: Leave) -> bool:
-        if enter.waiting:
-            return False
-        if (leave.name and re.search(
-                leave.name, enter.name,
-                re.NOFLAG if config.CaseSensitiveLeave else re.IGNORECASE
-        ) is None):
-            return False
-        if leave.type and enter.type != leave.type:
-            return False
-        return True
+        def search(enter_name: str) -> bool:
+            return pattern.search(enter_name) is not None
+
+        if not self.LITERAL.fullmatch(name):
+            match = search
+        elif config.CaseSensitiveLeave:
+            def match(enter_name: str) -> bool:
+                return name in enter_name
+        elif name.isascii():
+            lowered = name.lower()
+
+            def match(enter_name: str) -> bool:
+                if enter_name.isascii():
+                    return lowered in enter_name.lower()
+                return search(enter_name)
+        else:
+            match = search
+        self.leave_patterns[name] = match
+        return match
 
     def handle_leave_matched(self, leave: Leave, enter: Enter) -> None:
         del self.blocks[enter.linenumber]
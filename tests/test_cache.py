@@ -0,0 +1,61 @@
+"""
+The caches of a timeline are loaded the same as they were saved. Run by
+`python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'source'
+                       / 'lib'))
+
+from cache import ParseCache, CheckpointIndex  # noqa: E402
+from traverser import Traverser, Date  # noqa: E402
+
+# a date with an infinite day, whose number is a float, followed by enough
+# lines for CheckpointIndex to save a checkpoint after it
+TIMELINE = '@ oo.1.2000\n\n' + 'note\n\n' * CheckpointIndex.INTERVAL \
+           + '@ 1.oo.oo\nlast note\n'
+
+
+class InfiniteDateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        environ = mock.patch.dict(os.environ,
+                                  {'XDG_CACHE_HOME': directory.name})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.path = Path(directory.name) / 'timeline.tln'
+        self.path.write_text(TIMELINE)
+
+    def test_parse_cache(self) -> None:
+        parsed = ParseCache(self.path).elements()
+        self.assertTrue(ParseCache(self.path).is_current())
+        loaded = ParseCache(self.path).elements()
+        self.assertEqual([str(element) for element in loaded],
+                         [str(element) for element in parsed])
+        dates = [element for element in loaded if isinstance(element, Date)]
+        self.assertEqual(str(dates[0]), '@ ∞.1.2000')
+        self.assertEqual(str(dates[-1]), '@ 1.∞.∞')
+
+    def test_checkpoint_index(self) -> None:
+        # the lines above the last date
+        max_lines = TIMELINE.count('\n') - 1
+        self.assertEqual(
+            CheckpointIndex(self.path).traverse(Traverser(), max_lines), 0
+        )
+        traverser = Traverser()
+        resumed = CheckpointIndex(self.path).traverse(traverser, max_lines)
+        self.assertGreater(resumed, 0)
+        expected = Traverser()
+        with open(self.path) as file_in:
+            expected.traverse(file_in, max_lines)
+        self.assertEqual(repr(traverser.date), repr(expected.date))
+
+
+if __name__ == '__main__':
+    unittest.main()
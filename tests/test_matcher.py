@@ -0,0 +1,187 @@
+"""
+The matchers return the documented distances, and scoring the strings for
+an extended term or with a narrowed tolerance gives the same distances as
+scoring them from scratch. Run by `python -m unittest discover tests`.
+"""
+import random
+import sys
+import unittest
+from unittest import mock
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'source'
+                       / 'lib'))
+
+from rapidfuzz import fuzz  # noqa: E402
+
+from config import config  # noqa: E402
+from matcher import MATCHERS, Matcher, FuzzyMatcher, LiveSearch, \
+    ExactMatcher, RegexMatcher, TokenMatcher, SoundexMatcher  # noqa: E402
+
+WORDS = ['red', 'dragon', 'drag', 'ogre', 'tavern', 'inn', 'king', 'sword',
+         'Gorbash', 'tower', 'dream', 'rage', 'garden', 'road', 'knight']
+# the terms typed character by character, including deletions
+TYPED = ['d', 'dr', 'dra', 'drag', 'drago', 'dragon', 'dragon ', 'dragon k',
+         'drago', 'dragn', 'dr', 'ogre', 'ogre tav', 'og', '']
+
+
+def get_strings(count: int) -> list[str]:
+    # the same pseudo-random strings of one to six words for every test
+    generator = random.Random(0)
+    return [' '.join(generator.choices(WORDS, k=generator.randint(1, 6)))
+            for _ in range(count)]
+
+
+class MatcherTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        values = mock.patch.dict(config.__dict__, {
+            'CaseSensitiveSearch': False, 'FuzzySearchTolerance': 75
+        })
+        values.start()
+        self.addCleanup(values.stop)
+
+
+class DistanceTest(MatcherTestCase):
+    def test_exact(self) -> None:
+        matcher = ExactMatcher('Red Drag')
+        self.assertEqual(matcher.search('the red dragon'), 1)
+        self.assertEqual(matcher.search('the red ogre'), 0)
+
+    def test_regex(self) -> None:
+        matcher = RegexMatcher(r'dra\w+n\b')
+        self.assertEqual(matcher.search('The DRAGON'), 1)
+        self.assertEqual(matcher.search('dragons'), 0)
+
+    def test_token(self) -> None:
+        matcher = TokenMatcher('dragon, red!')
+        self.assertEqual(matcher.search('the red dragon'), 1)
+        self.assertEqual(matcher.search('red-dragon tavern'), 1)
+        self.assertEqual(matcher.search('ogre tavern'), 0)
+
+    def test_soundex(self) -> None:
+        self.assertEqual(SoundexMatcher.soundex('Robert'), 'R163')
+        self.assertEqual(SoundexMatcher.soundex('Ashcraft'), 'A261')
+        self.assertEqual(SoundexMatcher.soundex('Tymczak'), 'T522')
+        self.assertEqual(SoundexMatcher.soundex('42'), '')
+        matcher = SoundexMatcher('Rupert dragun')
+        self.assertEqual(matcher.search('the dragon of Robert'), 1)
+        self.assertEqual(matcher.search('the dragon'), 0)
+
+    def test_fuzzy(self) -> None:
+        matcher = FuzzyMatcher('Dragn')
+        score = round(fuzz.partial_ratio('dragn', 'the red dragon'))
+        self.assertEqual(matcher.search('the red dragon'), 101 - score)
+        self.assertEqual(matcher.search('a red dragon'),
+                         matcher.search('red dragon'))
+        self.assertEqual(matcher.search('dragn'), 1)
+        self.assertEqual(matcher.search('the ogre'), 0)
+
+    def test_pruning(self) -> None:
+        # the strings skipped by below_tolerance() wouldn't match anyway
+        for find in ('dragon', 'ogre tavern', 'kng swrd'):
+            matcher = FuzzyMatcher(find)
+            for string in get_strings(300):
+                with self.subTest(find=find, string=string):
+                    score = round(fuzz.partial_ratio(find, string))
+                    self.assertEqual(matcher.search(string),
+                                     101 - score if score >= 75 else 0)
+            self.assertGreater(matcher.pruned, 0)
+
+    def test_batch(self) -> None:
+        strings = get_strings(300)
+        for name, matcher_class in MATCHERS.items():
+            matcher = matcher_class('dragon')
+            with self.subTest(matcher=name):
+                self.assertEqual(matcher.search_batch(strings, 1),
+                                 [matcher.search(string)
+                                  for string in strings])
+
+
+class ExtendedTest(MatcherTestCase):
+    def assertExtended(self, matcher_class: type[Matcher]) -> None:
+        # score the strings for each term from the scores of the longest
+        # previous term it extends, as LiveSearch does
+        strings = get_strings(500)
+        choices = list(map(matcher_class.prepare, strings))
+        stack = []
+        for find in TYPED:
+            matcher = matcher_class(find)
+            while stack and not matcher.find.startswith(stack[-1].find):
+                stack.pop()
+            scores = matcher.search_extended(
+                choices, stack[-1] if stack else None, 1
+            )
+            stack.append(scores)
+            with self.subTest(find=find):
+                self.assertEqual(scores.distances,
+                                 matcher_class(find).search_batch(strings, 1))
+
+    def test_fuzzy(self) -> None:
+        self.assertExtended(FuzzyMatcher)
+
+    def test_token(self) -> None:
+        self.assertExtended(TokenMatcher)
+
+    def test_exact(self) -> None:
+        self.assertExtended(ExactMatcher)
+
+    def test_narrow(self) -> None:
+        # the distances below the narrowed one are exact, the others are
+        # either exact or 0
+        strings = get_strings(500)
+        for distance in (2, 10, 20, 26, 30):
+            matcher = FuzzyMatcher('dragon k')
+            matcher.narrow(distance)
+            expected = FuzzyMatcher('dragon k').search_batch(strings, 1)
+            narrowed = matcher.search_batch(strings, 1)
+            single = list(map(matcher.search, strings))
+            for string, exact, batch, one in zip(strings, expected, narrowed,
+                                                 single):
+                with self.subTest(distance=distance, string=string):
+                    self.assertEqual(batch, one)
+                    if exact < distance:
+                        self.assertEqual(batch, exact)
+                    else:
+                        self.assertIn(batch, (0, exact))
+
+
+class LiveSearchTest(MatcherTestCase):
+    def setUp(self) -> None:
+        super(LiveSearchTest, self).setUp()
+        self.strings = get_strings(200)
+        self.live = LiveSearch()
+
+    def search(self, find: str, key: str = 'timeline') -> FuzzyMatcher:
+        matcher = FuzzyMatcher(find)
+        distances = self.live.search(matcher, key, lambda: set(self.strings),
+                                     1)
+        self.assertEqual(distances, dict(zip(
+            self.strings, FuzzyMatcher(find).search_batch(self.strings, 1)
+        )))
+        return matcher
+
+    def test_stack(self) -> None:
+        for find in ('d', 'dr', 'dra', 'drag', 'dragon'):
+            self.search(find)
+        self.assertEqual([scores.find for scores in self.live.stack],
+                         ['d', 'dr', 'dra', 'drag', 'dragon'])
+        # deleting characters pops the scores without scoring anything
+        matcher = self.search('drag')
+        self.assertEqual(matcher.scored + matcher.pruned, 0)
+        self.assertEqual([scores.find for scores in self.live.stack],
+                         ['d', 'dr', 'dra', 'drag'])
+        # another character is scored from the common prefix
+        self.search('drat')
+        self.assertEqual([scores.find for scores in self.live.stack],
+                         ['d', 'dr', 'dra', 'drat'])
+
+    def test_key(self) -> None:
+        self.search('dra')
+        self.strings = self.strings[:100]
+        self.search('drag', 'changed')
+        self.assertEqual([scores.find for scores in self.live.stack],
+                         ['drag'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+The boolean queries are parsed by the grammar in query.py and evaluated by the
+distances of their terms. Run by `python -m unittest discover tests`.
+"""
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'source'
+                       / 'lib'))
+
+import query  # noqa: E402
+from query import QuerySyntaxError, NEGATIVE_DISTANCE  # noqa: E402
+
+
+class ParseTest(unittest.TestCase):
+    def assertParsed(self, text: str, expected: str) -> None:
+        self.assertEqual(repr(query.parse(text)), expected)
+
+    def test_is_query(self) -> None:
+        self.assertTrue(query.is_query('?ogre'))
+        self.assertTrue(query.is_query('  ?ogre'))
+        self.assertFalse(query.is_query('ogre AND inn'))
+        self.assertFalse(query.is_query('ogre?'))
+
+    def test_precedence(self) -> None:
+        self.assertParsed('?a OR b AND c', "('a' OR ('b' AND 'c'))")
+        self.assertParsed('?a AND b OR c', "(('a' AND 'b') OR 'c')")
+        self.assertParsed('?NOT a AND b', "(NOT 'a' AND 'b')")
+        self.assertParsed('?NOT NOT a', "NOT NOT 'a'")
+        self.assertParsed('?(a OR b) AND c', "(('a' OR 'b') AND 'c')")
+
+    def test_implicit_and(self) -> None:
+        self.assertParsed('?a (b) NOT c', "('a' AND 'b' AND NOT 'c')")
+        self.assertParsed('?(a) (b OR c)', "('a' AND ('b' OR 'c'))")
+
+    def test_words(self) -> None:
+        self.assertParsed('?red  dragon AND inn', "('red dragon' AND 'inn')")
+        # the operators have to be uppercase
+        self.assertParsed('?ogre and inn', "'ogre and inn'")
+
+    def test_quoting(self) -> None:
+        self.assertParsed('?"AND" OR "(b)"', "('AND' OR '(b)')")
+        self.assertParsed('?red "NOT" dragon', "'red NOT dragon'")
+        self.assertParsed('?" a  b "', "' a  b '")
+
+    def test_term_indices(self) -> None:
+        terms = list(query.parse('?a OR (b AND NOT c) d').get_terms())
+        self.assertEqual([term.text for term in terms], ['a', 'b', 'c', 'd'])
+        self.assertEqual([term.index for term in terms], [0, 1, 2, 3])
+
+    def test_errors(self) -> None:
+        for text in ('?', '?a AND', '?OR a', '?(a', '?a)', '?()', '?NOT',
+                     '?a "b', '?a "" b', '?a AND OR b'):
+            with self.subTest(text=text):
+                with self.assertRaises(QuerySyntaxError):
+                    query.parse(text)
+
+
+class EvaluateTest(unittest.TestCase):
+    def evaluate(self, text: str, *distances: int) -> int:
+        return query.parse(text).evaluate(distances)
+
+    def test_and(self) -> None:
+        self.assertEqual(self.evaluate('?a AND b', 20, 30), 30)
+        self.assertEqual(self.evaluate('?a AND b', 20, 0), 0)
+
+    def test_or(self) -> None:
+        self.assertEqual(self.evaluate('?a OR b', 20, 30), 20)
+        self.assertEqual(self.evaluate('?a OR b', 0, 30), 30)
+        self.assertEqual(self.evaluate('?a OR b', 0, 0), 0)
+
+    def test_not(self) -> None:
+        self.assertEqual(self.evaluate('?a NOT b', 20, 0), 20)
+        self.assertEqual(self.evaluate('?a NOT b', 20, 30), 0)
+        self.assertEqual(self.evaluate('?NOT a', 0), NEGATIVE_DISTANCE)
+        self.assertEqual(self.evaluate('?NOT a NOT b', 0, 0),
+                         NEGATIVE_DISTANCE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+A syncfile written in either format is read by open_sync() with the same
+links, for a single file and for a corpus laid out by Layout. Run by
+`python -m unittest discover tests`.
+"""
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'source'
+                       / 'lib'))
+
+from sync import SYNC_FORMATS, SyncFormat, Layout, TextSyncFile, \
+    BinarySyncFile, open_sync  # noqa: E402
+
+MAIN = Path('/timeline/notes.tln')
+PART = Path('/timeline/part.tln')
+
+
+def get_layout() -> Layout:
+    # the lines 1-10 of the main file, the lines 1-10 of the part and
+    # the rest of the main file
+    layout = Layout([MAIN, PART])
+    layout.add(1, 0, 0)
+    layout.add(11, 1, -10)
+    layout.add(21, 0, -10)
+    return layout
+
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'result.sync'
+
+    def write(self, sync_format: SyncFormat, parent_id: int | None) -> None:
+        # the heading, a line with a column, an unlinked line, three lines of
+        # the main file and, in the corpus, two lines of the part
+        chunks = [sync_format.header(parent_id, MAIN),
+                  sync_format.link(range(5, 6), 3),
+                  sync_format.unlinked(),
+                  sync_format.link(range(8, 11)),
+                  sync_format.link(range(12, 14))]
+        with open(self.path, 'w' + sync_format.MODE) as file_out:
+            for chunk in chunks:
+                file_out.write(chunk)
+
+    def assertRoundTrip(self, name: str, layout: Layout | None) -> None:
+        sync_format = SYNC_FORMATS[name](layout)
+        self.write(sync_format, 7)
+        sync = open_sync(self.path)
+        self.assertIsInstance(sync, {'text': TextSyncFile,
+                                     'binary': BinarySyncFile}[name])
+        self.assertEqual(sync.parent_id, 7)
+        self.assertEqual(sync.main_file, str(MAIN))
+        # the text format has no columns
+        column = 3 if name == 'binary' else 0
+        main, part = str(MAIN), str(PART if layout is not None else MAIN)
+        last = [(2, 0, part), (3, 0, part)] if layout is not None \
+            else [(12, 0, main), (13, 0, main)]
+        self.assertEqual(list(sync.get_links()), [
+            None, None, (5, column, main), None, (8, 0, main), (9, 0, main),
+            (10, 0, main), *last
+        ])
+        # the file is only given for a corpus
+        file = main if layout is not None else None
+        self.assertIsNone(sync.get_link(1))
+        self.assertEqual(sync.get_link(3), (5, column, file))
+        self.assertIsNone(sync.get_link(4))
+        self.assertEqual(sync.get_link(7), (10, 0, file))
+        self.assertIsNone(sync.get_link(10))
+        self.assertEqual(sync.get_lines(9), [6])
+        self.assertEqual(sync.get_lines(9, main), [6])
+        self.assertEqual(sync.get_lines(4), [])
+        if layout is not None:
+            self.assertEqual(sync.get_link(9), (3, 0, str(PART)))
+            self.assertEqual(sync.get_lines(3, str(PART)), [9])
+            self.assertEqual(sync.get_lines(13), [])
+        else:
+            self.assertEqual(sync.get_lines(13), [9])
+        sync.set_parent_id(None)
+        self.assertIsNone(open_sync(self.path).parent_id)
+        sync.set_parent_id(42)
+        self.assertEqual(open_sync(self.path).parent_id, 42)
+        self.assertEqual(list(open_sync(self.path).get_links()),
+                         list(sync.get_links()))
+
+    def test_text(self) -> None:
+        self.assertRoundTrip('text', None)
+
+    def test_binary(self) -> None:
+        self.assertRoundTrip('binary', None)
+
+    def test_text_corpus(self) -> None:
+        self.assertRoundTrip('text', get_layout())
+
+    def test_binary_corpus(self) -> None:
+        self.assertRoundTrip('binary', get_layout())
+
+    def test_no_parent(self) -> None:
+        for name in SYNC_FORMATS:
+            with self.subTest(format=name):
+                self.write(SYNC_FORMATS[name](), None)
+                self.assertIsNone(open_sync(self.path).parent_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Benchmark the traversal, filtering, list.py and the pruning of the filter
+cache on a timeline from generate.py. Each benchmark reports the best time of
+several runs, the throughput in lines per second and the peak memory measured
+in a separate run by tracemalloc. The results can be saved as a baseline and
+later runs compared against it.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import Namespace
+from collections.abc import Callable
+from pathlib import Path
+
+TOOLS = Path(__file__).resolve().parent
+BASELINES = TOOLS / 'baselines'
+sys.path.insert(0, str(TOOLS.parent / 'source' / 'lib'))
+
+from generate import Generator  # noqa: E402
+from config import config  # noqa: E402
+from traverser import Traverser, Element  # noqa: E402
+from filter import Filter, QueryFilter, RankedFilter, prune_cache  # noqa: E402
+from list import get_output  # noqa: E402
+from cache import get_cache_dir, Manifest  # noqa: E402
+import query  # noqa: E402
+
+# filter benchmarks: (name, find, tolerance, matcher)
+FILTERS = (
+    ('word', 'ogre', 75, 'fuzzy'),
+    ('word-loose', 'ogre', 50, 'fuzzy'),
+    ('word-strict', 'ogre', 90, 'fuzzy'),
+    ('phrase', 'red dragon tavern', 75, 'fuzzy'),
+    ('name', 'Gorbash', 75, 'fuzzy'),
+    ('date', '1.2.1201', 75, 'fuzzy'),
+    ('query', '?ogre AND (tavern OR inn) NOT dream', 75, 'fuzzy'),
+    ('exact', 'ogre', 75, 'exact'),
+    ('regex', r'og(re|er)s?\b', 75, 'regex'),
+    ('token', 'tavern ogre', 75, 'token'),
+)
+# ranked filter benchmarks: the term and the numbers of the closest elements
+# to find. The ranking is timed alone and together with copying the parsed
+# elements and the traversal, as timelined does it.
+RANKED = ('ogre', (1, 20, 200))
+# list.py benchmarks: the cursor positions as fractions of the file
+DEPTHS = (.1, .5, .9)
+# the number of filter results created and pruned one by one in the prune_cache
+# benchmark, with half of them kept in the cache. Its throughput is reported
+# in results per second instead of lines.
+CACHED_RESULTS = 200
+
+
+class Benchmark:
+    def __init__(self, args: Namespace, workdir: Path) -> None:
+        self.args = args
+        self.workdir = workdir
+        self.timeline = workdir / 'benchmark.tln'
+        with open(self.timeline, 'w') as file_out:
+            for line in Generator(Namespace(
+                    seed=args.seed, days=args.days, density=6, depth=4,
+                    blocks=.15, interleave=.3, lists=.2, descriptions=.08,
+                    ellipses=.04, names=40
+            )).lines():
+                print(line, file=file_out)
+        with open(self.timeline) as file_in:
+            self.lines = sum(1 for _ in file_in)
+        self.results: dict[str, dict[str, float]] = {}
+
+    def configure(self, **values) -> None:
+        # the configuration is read-only, write it to the timeline.conf in
+        # the working directory instead, which overrides the other files
+        with open(self.workdir / 'timeline.conf', 'w') as file_out:
+            print('[timeline]', file=file_out)
+            for key, value in values.items():
+                print(f'{key} = {value}', file=file_out)
+        config.reload()
+
+    def measure(self, name: str, function: Callable[[], object],
+                lines: int) -> None:
+        times = []
+        for _ in range(self.args.repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        best = min(times)
+        self.results[name] = {
+            'seconds': best,
+            'lines_per_second': lines / best,
+            'peak_bytes': peak,
+        }
+        print(f'{name:24} {best:8.3f} s {lines / best:12.0f} lines/s '
+              f'{peak / 2**20:8.1f} MiB', flush=True)
+
+    def bench_traverse(self) -> None:
+        with open(self.timeline) as file_in:
+            Traverser().traverse(file_in)
+
+    def bench_filter(self, find: str) -> None:
+        filter_ = (QueryFilter if query.is_query(find) else Filter)(find)
+        with filter_, open(self.timeline) as file_in:
+            filter_.filter(file_in)
+
+    def bench_rank(self, find: str, top: int,
+                   elements: list[Element]) -> None:
+        # only the ranking, the traversal would change the elements
+        with RankedFilter(find, top=top) as filter_:
+            filter_.rank(elements)
+
+    def bench_ranked(self, find: str, top: int, pickled: bytes) -> None:
+        with RankedFilter(find, top=top) as filter_:
+            filter_.filter_replayed(pickle.loads(pickled))
+
+    def bench_list(self, line: int) -> None:
+        traverser = Traverser()
+        with open(self.timeline) as file_in:
+            traverser.traverse(file_in, line)
+        get_output(traverser, False)
+
+    def bench_prune(self) -> None:
+        cache = get_cache_dir()
+        for index in range(CACHED_RESULTS):
+            basename = f'{cache / f"{index:04}"}'
+            with Manifest() as manifest:
+                manifest.add(basename)
+            for suffix in ('.tln', '.sync'):
+                Path(f'{basename}{suffix}').write_text('x' * 1000)
+            prune_cache(basename)
+
+    def run(self) -> None:
+        self.configure()
+        self.measure('traverse', self.bench_traverse, self.lines)
+        for name, find, tolerance, matcher in FILTERS:
+            self.configure(FuzzySearchTolerance=tolerance, Matcher=matcher)
+            self.measure(f'filter {name}', lambda: self.bench_filter(find),
+                         self.lines)
+        self.configure()
+        find, tops = RANKED
+        with open(self.timeline) as file_in:
+            elements = list(Traverser().parse_lines(file_in, -1))
+        pickled = pickle.dumps(elements, pickle.HIGHEST_PROTOCOL)
+        self.measure('copy elements', lambda: pickle.loads(pickled),
+                     self.lines)
+        for top in tops:
+            self.measure(f'rank top {top}',
+                         lambda: self.bench_rank(find, top, elements),
+                         self.lines)
+            self.measure(f'filter top {top}',
+                         lambda: self.bench_ranked(find, top, pickled),
+                         self.lines)
+        for depth in DEPTHS:
+            line = int(self.lines * depth)
+            self.measure(f'list {depth:.0%}', lambda: self.bench_list(line),
+                         line)
+        self.configure(FilterHistoryCount=CACHED_RESULTS // 2)
+        self.measure('prune_cache', self.bench_prune, CACHED_RESULTS)
+
+
+def compare(results: dict[str, dict[str, float]],
+            baseline: dict[str, dict[str, float]]) -> None:
+    print(f'\n{"":24} {"time":>10} {"memory":>10}   (relative to baseline)')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        print(f'{name:24} {result["seconds"] / old["seconds"]:10.2f} '
+              f'{result["peak_bytes"] / max(old["peak_bytes"], 1):10.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed of the generated timeline')
+    parser.add_argument('--days', type=int, default=3000,
+                        help='the number of dates of the generated timeline')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of timed runs of each benchmark')
+    parser.add_argument('--save', metavar='NAME',
+                        help=f'save the results as a baseline to {BASELINES}')
+    parser.add_argument('--compare', metavar='NAME',
+                        help='compare the results with a saved baseline')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(BASELINES / f'{args.compare}.json') as file_in:
+            baseline = json.load(file_in)
+        if (baseline['seed'], baseline['days']) != (args.seed, args.days):
+            parser.error('the baseline was measured on another timeline, use '
+                         f'--seed {baseline["seed"]} --days {baseline["days"]}')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # keep the cache and the configuration of the user out of it
+        os.environ['XDG_CACHE_HOME'] = workdir
+        os.environ['HOME'] = workdir
+        os.chdir(workdir)
+        benchmark = Benchmark(args, Path(workdir))
+        print(f'{benchmark.lines} lines, {benchmark.timeline.stat().st_size} '
+              f'bytes')
+        benchmark.run()
+
+    if baseline is not None:
+        compare(benchmark.results, baseline['results'])
+    if args.save:
+        BASELINES.mkdir(exist_ok=True)
+        with open(BASELINES / f'{args.save}.json', 'w') as file_out:
+            json.dump({'seed': args.seed, 'days': args.days,
+                       'results': benchmark.results}, file_out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Generate a synthetic timeline for benchmarks. The output depends only on
+the arguments, so the same timeline can be generated again on another machine
+or for another release.
+"""
+import argparse
+import random
+from collections.abc import Iterator
+
+WORDS = (
+    'ogre tavern inn dream dragon king queen sword shield gold silver forest '
+    'river mountain castle village wizard goblin troll elf dwarf ring potion '
+    'scroll map key door bridge tower cave ship harbor merchant guard thief '
+    'priest temple market road night morning rumor letter debt storm wolf'
+).split()
+SYLLABLES = ('ka el dor mi ra th an gor bash wyn ost ul ve ri ta sel um bro '
+             'nd ash fen lo mar is').split()
+BLOCK_TYPES = ('', 'c', 'l', 'q')
+LIST_TYPES = ('-', '-loot', '-todo')
+
+
+class Generator:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.names = self.get_names(args.names)
+        # the open blocks, (type, name), the innermost last
+        self.open: list[tuple[str, str]] = []
+
+    def get_names(self, count: int) -> list[str]:
+        # capitalized names of one or two words, no two of them starting with
+        # the same four letters, so that the leaves can use prefixes
+        names: dict[str, str] = {}
+        while len(names) < count:
+            words = [
+                ''.join(self.random.choices(SYLLABLES,
+                                            k=self.random.randint(2, 3)))
+                for _ in range(1 if self.random.random() < .7 else 2)
+            ]
+            name = ' '.join(word.capitalize() for word in words)
+            names.setdefault(name[:4].lower(), name)
+        return list(names.values())
+
+    def sentence(self, length: int | None = None) -> str:
+        length = length or self.random.randint(3, 14)
+        return ' '.join(self.random.choice(WORDS) if self.random.random() < .9
+                        else self.random.choice(self.names)
+                        for _ in range(length))
+
+    def indent(self) -> str:
+        return '  ' * len(self.open)
+
+    def in_list(self) -> bool:
+        return bool(self.open) and self.open[-1][0].startswith('-')
+
+    def lines(self) -> Iterator[str]:
+        day, month, year = 0, 1, 1200
+        for _ in range(self.args.days):
+            day += self.random.randint(1, 3)
+            if day > 28:
+                day, month = 1, month + 1
+                if month > 12:
+                    month, year = 1, year + 1
+                yield f'@ {day}.{month}.{year}'
+            elif self.random.random() < .2:
+                # only the day changes, the rest is implied
+                yield f'@ {day}'
+            else:
+                yield f'@ {day}.{month}.{year}'
+            yield ''
+            for _ in range(max(1, round(self.random.expovariate(
+                    1 / self.args.density)))):
+                yield from self.event()
+            # some blocks span several days
+            while self.open and self.random.random() < .6:
+                yield from self.leave(len(self.open) - 1)
+        while self.open:
+            yield from self.leave(len(self.open) - 1)
+
+    def event(self) -> Iterator[str]:
+        args = self.args
+        roll = self.random.random()
+        if roll < args.blocks and len(self.open) < args.depth:
+            yield from self.enter()
+        elif roll < 2 * args.blocks and self.open:
+            if self.random.random() < args.interleave:
+                index = self.random.randrange(len(self.open))
+            else:
+                index = len(self.open) - 1
+            yield from self.leave(index)
+        elif roll < 2 * args.blocks + args.descriptions:
+            yield (f'{self.indent()}= {self.random.choice(self.names)} = '
+                   f'{self.sentence(4)}')
+        elif roll < 2 * args.blocks + args.descriptions + args.ellipses:
+            yield f'{self.indent()}...'
+        elif self.in_list():
+            for _ in range(self.random.randint(1, 5)):
+                yield f'{self.indent()}- {self.sentence()}'
+        else:
+            for _ in range(self.random.randint(1, 3)):
+                comment = ' # aside' if self.random.random() < .05 else ''
+                yield f'{self.indent()}{self.sentence()}{comment}'
+            yield ''
+
+    def enter(self) -> Iterator[str]:
+        if self.random.random() < self.args.lists:
+            type_ = self.random.choice(LIST_TYPES)
+        else:
+            type_ = self.random.choice(BLOCK_TYPES)
+        taken = {name[:4] for _, name in self.open}
+        name = self.random.choice([name for name in self.names
+                                   if name[:4] not in taken])
+        descriptions = ''.join(f' = {self.sentence(3)}' for _ in range(
+            self.random.choices((0, 1, 2), (6, 3, 1))[0]))
+        yield f'{self.indent()}>{type_} {name}{descriptions}'
+        self.open.append((type_, name))
+
+    def leave(self, index: int) -> Iterator[str]:
+        type_, name = self.open.pop(index)
+        later = self.open[index:]
+        # the shortest form that doesn't match any block entered later
+        for leave_type, pattern in ((type_, name[:4]), ('', name.split()[0]),
+                                    (type_, name)):
+            if not any(
+                    pattern.lower() in other_name.lower()
+                    and (not leave_type or leave_type == other_type)
+                    for other_type, other_name in later
+            ):
+                break
+        else:
+            # can't be left by name, leave the innermost block instead
+            self.open.insert(index, (type_, name))
+            yield from self.leave(len(self.open) - 1)
+            return
+        if self.random.random() < .5:
+            pattern = pattern.lower()
+        yield f'{self.indent()}<{leave_type} {pattern}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--days', type=int, default=1000,
+                        help='the number of dates')
+    parser.add_argument('--density', type=float, default=6,
+                        help='the mean number of events per date')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='the maximum number of open blocks')
+    parser.add_argument('--blocks', type=float, default=.15,
+                        help='the probability that an event enters a block, '
+                             'the same as that it leaves one')
+    parser.add_argument('--interleave', type=float, default=.3,
+                        help='the probability that a leave is not of the '
+                             'innermost block')
+    parser.add_argument('--lists', type=float, default=.2,
+                        help='the probability that a block is a list')
+    parser.add_argument('--descriptions', type=float, default=.08,
+                        help='the probability that an event is a description')
+    parser.add_argument('--ellipses', type=float, default=.04,
+                        help='the probability that an event is an ellipse')
+    parser.add_argument('--names', type=int, default=40,
+                        help='the number of distinct block names')
+    args = parser.parse_args()
+    for line in Generator(args).lines():
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Stand-in for kitty listening for remote control commands, to try
+the commands sent by link.py and source/lib/kitty.py without kitty. Every
+command is printed as a JSON object on a single line and answered as kitty
+would answer it, unless it has no_response. Run it and point the client at it:
+
+    tools/kitty_mock.py /tmp/kitty-mock &
+    KITTY_LISTEN_ON=unix:/tmp/kitty-mock source/lib/link.py RESULT.tln 10 1
+"""
+import argparse
+import base64
+import json
+import socketserver
+import sys
+from pathlib import Path
+from typing import Any
+
+TOOLS = Path(__file__).resolve().parent
+sys.path.insert(0, str(TOOLS.parent / 'source' / 'lib'))
+
+from kitty import PREFIX, SUFFIX  # noqa: E402
+
+
+class Handler(socketserver.StreamRequestHandler):
+    server: 'Server'
+
+    def handle(self) -> None:
+        data = b''
+        while True:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            data += chunk
+            while (end := data.find(SUFFIX)) >= 0:
+                message, data = data[:end], data[end + len(SUFFIX):]
+                command = json.loads(message[message.find(PREFIX)
+                                             + len(PREFIX):])
+                response = self.server.respond(command)
+                if not command.get('no_response'):
+                    self.wfile.write(PREFIX + json.dumps(response).encode()
+                                     + SUFFIX)
+                if self.server.close_after:
+                    # like kitty versions that take one command per connection
+                    return
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    def __init__(self, path: Path, close_after: bool,
+                 fail: list[str]) -> None:
+        super().__init__(str(path), Handler)
+        self.close_after = close_after
+        # the commands that are answered by an error
+        self.fail = fail
+        # the id of the next launched window
+        self.window_id = 100
+
+    def respond(self, command: dict[str, Any]) -> dict[str, Any]:
+        payload = command.get('payload', {})
+        if payload.get('data', '').startswith('base64:'):
+            # show the text that would be sent
+            payload['text'] = base64.standard_b64decode(
+                payload['data'][len('base64:'):]
+            ).decode()
+        print(json.dumps(command), flush=True)
+        if command['cmd'] in self.fail:
+            return {'ok': False, 'error': f'{command["cmd"]} failed'}
+        if command['cmd'] == 'launch':
+            self.window_id += 1
+            return {'ok': True, 'data': self.window_id}
+        return {'ok': True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('socket', type=Path,
+                        help='the path of the Unix socket to listen on')
+    parser.add_argument('--close', action='store_true',
+                        help='close the connection after every command')
+    parser.add_argument('--fail', action='append', default=[],
+                        metavar='COMMAND',
+                        help='answer COMMAND by an error, can be repeated')
+    args = parser.parse_args()
+    args.socket.unlink(missing_ok=True)
+    with Server(args.socket, args.close, args.fail) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            args.socket.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()